@@ -0,0 +1,77 @@
+import json
+
+from tts_webui_extension.stable_audio.batch import (
+    JOB_DEFAULTS,
+    group_jobs,
+    read_manifest,
+    read_progress,
+)
+
+
+def write_lines(path, lines):
+    path.write_text("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+
+def make_job(job_id, **params):
+    return {**JOB_DEFAULTS, "prompt": f"prompt {job_id}", "id": job_id, **params}
+
+
+def test_read_manifest_fills_defaults_and_ids(tmp_path):
+    path = write_lines(
+        tmp_path / "manifest.jsonl",
+        [
+            json.dumps({"prompt": "rain"}),
+            "",
+            json.dumps({"prompt": "wind", "id": 7, "steps": 50}),
+        ],
+    )
+    jobs = read_manifest(path)
+
+    assert [job["id"] for job in jobs] == ["1", "7"]
+    assert jobs[0]["steps"] == JOB_DEFAULTS["steps"]
+    assert jobs[1]["steps"] == 50
+
+
+def test_group_jobs_splits_by_params_and_batch_size():
+    jobs = [
+        make_job("a"),
+        make_job("b", steps=50),
+        make_job("c"),
+        make_job("d"),
+    ]
+    batches = group_jobs(jobs, batch_size=2)
+
+    assert [[job["id"] for job in batch] for batch in batches] == [
+        ["a", "c"],
+        ["d"],
+        ["b"],
+    ]
+
+
+def test_group_jobs_keeps_negative_prompts_apart():
+    jobs = [
+        make_job("a"),
+        make_job("b", negative_prompt="noise"),
+        make_job("c", negative_prompt="hiss"),
+    ]
+    batches = group_jobs(jobs, batch_size=4)
+
+    assert [[job["id"] for job in batch] for batch in batches] == [["a"], ["b", "c"]]
+
+
+def test_read_progress_skips_truncated_line(tmp_path):
+    path = write_lines(
+        tmp_path / "manifest.jsonl.progress.jsonl",
+        [
+            json.dumps({"id": "1", "path": "outputs/1"}),
+            json.dumps({"id": "2", "path": "outputs/2"}),
+            '{"id": "3", "pa',
+        ],
+    )
+
+    assert read_progress(path) == {"1": "outputs/1", "2": "outputs/2"}
+
+
+def test_read_progress_without_file(tmp_path):
+    assert read_progress(str(tmp_path / "missing.jsonl")) == {}
@@ -0,0 +1,20 @@
+import pytest
+
+from tts_webui_extension.stable_audio.cfg_modes import CFG_MODES, resolve_cfg_mode
+
+
+def test_auto_skips_unconditional_only_without_guidance():
+    assert resolve_cfg_mode("Auto", 1.0) == "Skip unconditional"
+    assert resolve_cfg_mode("Auto", "1") == "Skip unconditional"
+    assert resolve_cfg_mode("Auto", 7.0) == "Batched"
+
+
+def test_explicit_modes_are_kept():
+    assert resolve_cfg_mode("Batched", 1.0) == "Batched"
+    assert resolve_cfg_mode("Sequential", 7.0) == "Sequential"
+
+
+def test_unknown_mode_is_rejected():
+    assert "Skip unconditional" not in CFG_MODES
+    with pytest.raises(Exception, match="Unknown CFG mode"):
+        resolve_cfg_mode("Skip unconditional", 7.0)
@@ -0,0 +1,98 @@
+import wave
+import sqlite3
+
+import pytest
+
+from tts_webui_extension.stable_audio import history
+
+
+@pytest.fixture(autouse=True)
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "history.sqlite")
+    monkeypatch.setattr(history, "get_db_path", lambda: path)
+    return path
+
+
+def add(tmp_path, name, **params):
+    wav_path = str(tmp_path / f"{name}.wav")
+    with wave.open(wav_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(name.encode().ljust(16000, b"\0"))
+    params = {
+        "prompt": "rain",
+        "model": "stable-audio-open-1.0",
+        "seed": 1,
+        "steps": 100,
+        **params,
+    }
+    history.add_result(wav_path, params)
+    return wav_path
+
+
+def test_search_date_to_includes_the_whole_day(tmp_path):
+    add(tmp_path, "a", date="2024-05-01_09-00-00")
+    add(tmp_path, "b", date="2024-05-02_23-59-59")
+    add(tmp_path, "c", date="2024-05-03_00-00-00")
+
+    dates = [row[0] for row in history.search(date_to="2024-05-02")]
+    assert dates == ["2024-05-02_23-59-59", "2024-05-01_09-00-00"]
+
+    dates = [
+        row[0] for row in history.search(date_from="2024-05-02", date_to="2024-05-02")
+    ]
+    assert dates == ["2024-05-02_23-59-59"]
+
+
+def test_search_filters_prompt_and_model(tmp_path):
+    add(tmp_path, "a", date="2024-05-01_09-00-00", prompt="heavy rain")
+    add(tmp_path, "b", date="2024-05-01_10-00-00", prompt="wind")
+    add(tmp_path, "c", date="2024-05-01_11-00-00", prompt="rain", model="other")
+
+    rows = history.search(prompt="rain", model="stable-audio-open-1.0")
+    assert [row[1] for row in rows] == ["heavy rain"]
+
+
+def test_find_duplicates_ignores_volatile_keys(tmp_path):
+    first = add(tmp_path, "a", date="2024-05-01_09-00-00", steps_used=40)
+    second = add(tmp_path, "b", date="2024-05-02_09-00-00", steps_used=100)
+    add(tmp_path, "c", date="2024-05-03_09-00-00", seed=2)
+
+    duplicates = history.find_duplicates()
+    assert len(duplicates) == 1
+    prompt, model, seed, copies, paths = duplicates[0]
+    assert (prompt, seed, copies) == ("rain", "1", 2)
+    assert sorted(paths.split("\n")) == sorted([first, second])
+
+
+def test_add_result_indexes_each_path_once(tmp_path):
+    path = add(tmp_path, "a", date="2024-05-01_09-00-00")
+    history.add_result(path, {"prompt": "rain", "date": "2024-05-01_09-00-00"})
+
+    assert len(history.search()) == 1
+
+
+def test_search_prompt_words_in_any_order(tmp_path):
+    add(tmp_path, "a", date="2024-05-01_09-00-00", prompt="Heavy rain on a tin roof")
+    add(tmp_path, "b", date="2024-05-01_10-00-00", prompt="Rainforest birds")
+    add(tmp_path, "c", date="2024-05-01_11-00-00", prompt="Wind in the trees")
+
+    assert [row[1] for row in history.search(prompt="roof rain")] == [
+        "Heavy rain on a tin roof"
+    ]
+    assert len(history.search(prompt="rain")) == 2
+    assert history.search(prompt='tin "roof') == history.search(prompt="tin roof")
+
+
+def test_prompts_indexed_before_the_search_table_are_found(tmp_path, db_path):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(history.SCHEMA.split("DROP INDEX")[0])
+    connection.execute(
+        "INSERT INTO generations (path, date, prompt) VALUES (?, ?, ?)",
+        ("old.wav", "2024-05-01_09-00-00", "Old rain"),
+    )
+    connection.commit()
+    connection.close()
+
+    assert [row[1] for row in history.search(prompt="rain")] == ["Old rain"]
@@ -0,0 +1,51 @@
+import io
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("fastapi")
+
+from pydantic import ValidationError
+
+from tts_webui_extension.stable_audio.http_api import (
+    GenerateRequest,
+    encode_audio,
+    iter_audio_chunks,
+)
+
+
+def make_audio(frames=50000, channels=2):
+    return np.arange(frames * channels, dtype=np.int16).reshape(frames, channels)
+
+
+def test_wav_round_trip():
+    data = make_audio()
+    with wave.open(io.BytesIO(encode_audio(44100, data, "wav")), "rb") as wav_file:
+        assert wav_file.getframerate() == 44100
+        assert wav_file.getnchannels() == 2
+        assert wav_file.getsampwidth() == 2
+        frames = wav_file.readframes(wav_file.getnframes())
+    assert frames == data.astype("<i2").tobytes()
+
+
+def test_stream_matches_body_in_chunks():
+    data = make_audio()
+    chunks = list(iter_audio_chunks(44100, data, "pcm"))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == encode_audio(44100, data, "pcm")
+
+
+def test_request_rejects_unknown_choices():
+    assert GenerateRequest(prompt="rain").sampler_type == "dpmpp-3m-sde"
+    for field in ["sampler_type", "profile", "cfg_mode", "format"]:
+        with pytest.raises(ValidationError):
+            GenerateRequest(prompt="rain", **{field: "unknown"})
+
+
+def test_request_bounds():
+    with pytest.raises(ValidationError):
+        GenerateRequest(prompt="rain", steps=0)
+    with pytest.raises(ValidationError):
+        GenerateRequest(prompt="rain", seconds_total=0)
@@ -0,0 +1,30 @@
+import pytest
+
+from tts_webui_extension.stable_audio.longform import count_windows, crossfade
+
+
+def test_one_window_when_it_fits():
+    assert count_windows(100, 100, 10) == 1
+    assert count_windows(50, 100, 10) == 1
+
+
+@pytest.mark.parametrize("total_n", [101, 190, 191, 1000, 12345])
+def test_windows_cover_the_duration_without_spare(total_n):
+    window_n, overlap_n = 100, 10
+    num_windows = count_windows(total_n, window_n, overlap_n)
+    step_n = window_n - overlap_n
+
+    assert window_n + (num_windows - 1) * step_n >= total_n
+    assert window_n + (num_windows - 2) * step_n < total_n
+
+
+def test_crossfade_blends_only_the_overlap():
+    torch = pytest.importorskip("torch")
+    tail = torch.zeros(2, 5)
+    audio = torch.ones(2, 12)
+
+    faded = crossfade(tail, audio, 5)
+    assert faded.shape == audio.shape
+    assert torch.equal(faded[:, 0], torch.zeros(2))
+    assert torch.equal(faded[:, 4:], torch.ones(2, 8))
+    assert bool((faded[:, 1:4] > 0).all() and (faded[:, 1:4] < 1).all())
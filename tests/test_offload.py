@@ -0,0 +1,34 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from tts_webui_extension.stable_audio.offload import StagedOffload
+
+
+def make_offload(mode, copy_stream):
+    offload = StagedOffload.__new__(StagedOffload)
+    offload.mode = mode
+    offload.copy_stream = copy_stream
+    offload.stages = {
+        "conditioner": ([], [torch.zeros(256 * 1024)]),
+        "diffusion": ([], [torch.zeros(1024 * 1024)]),
+        "pretransform": ([], [torch.zeros(512 * 1024)]),
+    }
+    return offload
+
+
+def test_report_keeps_one_stage_resident():
+    report = make_offload("Disk (mmap)", None).get_report()
+
+    assert report["stage_mb"] == {"conditioner": 1, "diffusion": 4, "pretransform": 2}
+    assert report["all_resident_mb"] == 7
+    assert report["offloaded_mb"] == 4
+    assert report["saved_mb"] == 3
+
+
+def test_report_counts_the_prefetched_stage():
+    # With the side stream the next stage is on the device as well
+    report = make_offload("CPU", object()).get_report()
+
+    assert report["offloaded_mb"] == 6
+    assert report["saved_mb"] == 1
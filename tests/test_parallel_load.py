@@ -0,0 +1,29 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from tts_webui_extension.stable_audio.parallel_load import read_component
+
+
+def test_read_component_takes_its_prefix_only():
+    state_dict = {
+        "model.weight": torch.ones(2, dtype=torch.float32),
+        "model.steps": torch.tensor([3]),
+        "conditioner.weight": torch.zeros(2),
+    }
+    weights, _ = read_component(state_dict, "model.", True, False)
+
+    assert sorted(weights) == ["steps", "weight"]
+    assert weights["weight"].dtype == torch.float16
+    # Integer buffers keep their dtype in half precision
+    assert weights["steps"].dtype == state_dict["model.steps"].dtype
+
+
+def test_read_component_copies_unless_mapped():
+    state_dict = {"model.weight": torch.ones(2)}
+
+    copied, _ = read_component(state_dict, "model.", False, False)
+    mapped, _ = read_component(state_dict, "model.", False, True)
+
+    assert copied["weight"].data_ptr() != state_dict["model.weight"].data_ptr()
+    assert mapped["weight"].data_ptr() == state_dict["model.weight"].data_ptr()
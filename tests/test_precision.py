@@ -0,0 +1,19 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from tts_webui_extension.stable_audio.precision import snr_db, spectral_distance
+
+
+def test_snr_db():
+    reference = torch.ones(2, 1000)
+
+    assert snr_db(reference, reference * 0.9) == pytest.approx(20.0, abs=0.01)
+    assert snr_db(reference, reference) > 100
+
+
+def test_spectral_distance_is_zero_for_identical_audio():
+    audio = torch.sin(torch.arange(2, 8000).float().reshape(2, -1) * 0.05)
+
+    assert spectral_distance(audio, audio) == 0
+    assert spectral_distance(audio, audio * 0.5) > 0
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from tts_webui_extension.stable_audio.sampling_control import (
+    GenerationCancelled,
+    SamplingMonitor,
+    StopSampling,
+    count,
+    get_metrics,
+    get_step_counts,
+    resolve_steps,
+)
+
+
+def step(monitor, i, denoised=None):
+    monitor({"i": i, "denoised": denoised})
+
+
+def test_resolve_steps():
+    assert resolve_steps("Custom", "k-heun", 100) == 100
+    assert resolve_steps("Fast", "k-heun", 100) == 16
+    assert resolve_steps("Fast", "unknown", 100) == 100
+
+
+@pytest.mark.parametrize("steps", [1, 2, 3, 4, 5, 24, 48, 100])
+def test_dpm_fast_step_counts_end_at_steps(steps):
+    counts = get_step_counts("k-dpm-fast", steps)
+    assert counts[-1] == steps
+    assert counts == sorted(set(counts))
+
+
+def test_dpm_fast_run_records_all_steps():
+    # 24 evaluations are 9 solver iterations, 3 each then 2 and 1
+    monitor = SamplingMonitor(steps=24, sampler_type="k-dpm-fast")
+    for i in range(9):
+        step(monitor, i)
+    assert monitor.steps_used == 24
+
+
+def test_other_samplers_count_callbacks():
+    monitor = SamplingMonitor(steps=10, sampler_type="dpmpp-3m-sde")
+    for i in range(10):
+        step(monitor, i)
+    assert monitor.steps_used == 10
+
+
+def test_early_exit_after_minimum_fraction():
+    torch = pytest.importorskip("torch")
+    monitor = SamplingMonitor(steps=8, early_exit_threshold=0.01)
+    denoised = torch.ones(1, 4, 16)
+
+    # Converged from the start, but not allowed to stop before 2 of 8 steps
+    step(monitor, 0, denoised)
+    with pytest.raises(StopSampling) as stop:
+        step(monitor, 1, denoised)
+    assert stop.value.reason == "early_exit"
+    assert monitor.steps_used == 2
+
+
+def test_dpm_fast_early_exit_gate_uses_steps():
+    torch = pytest.importorskip("torch")
+    monitor = SamplingMonitor(
+        steps=24, early_exit_threshold=0.01, sampler_type="k-dpm-fast"
+    )
+    denoised = torch.ones(1, 4, 16)
+
+    # Iteration 1 has spent 6 of 24 steps, the 25% minimum
+    step(monitor, 0, denoised)
+    with pytest.raises(StopSampling):
+        step(monitor, 1, denoised)
+    assert monitor.steps_used == 6
+
+
+def test_no_early_exit_while_changing():
+    torch = pytest.importorskip("torch")
+    monitor = SamplingMonitor(steps=4, early_exit_threshold=0.01)
+    for i in range(4):
+        step(monitor, i, torch.full((1, 4, 16), float(i + 1)))
+    assert monitor.steps_used == 4
+
+
+def test_cancel_stops_at_next_step():
+    cancelled = []
+    monitor = SamplingMonitor(steps=4, is_cancelled=lambda: bool(cancelled))
+    step(monitor, 0)
+    cancelled.append(True)
+    with pytest.raises(GenerationCancelled) as stop:
+        step(monitor, 1)
+    assert stop.value.reason == "cancelled"
+    assert monitor.steps_used == 2
+
+
+def test_deadline_exceeded():
+    monitor = SamplingMonitor(steps=4, deadline=time.time() - 1)
+    with pytest.raises(GenerationCancelled) as stop:
+        monitor.check_cancelled()
+    assert stop.value.reason == "deadline_exceeded"
+
+
+def test_count_outcomes_and_steps():
+    before = get_metrics()
+    count("cancelled", 3)
+    after = get_metrics()
+    assert after["cancelled"] == before.get("cancelled", 0) + 1
+    assert after["cancelled_steps"] == before.get("cancelled_steps", 0) + 3
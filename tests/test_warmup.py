@@ -0,0 +1,49 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+from tts_webui_extension.stable_audio import warmup
+
+
+@pytest.fixture
+def compile_cache(tmp_path, monkeypatch):
+    def get_compile_cache_dir(model_name):
+        return str(tmp_path / model_name)
+
+    monkeypatch.setattr(warmup, "get_compile_cache_dir", get_compile_cache_dir)
+    for name in warmup.CACHE_DIR_VARIABLES:
+        # Set first so the original value is restored after the test
+        monkeypatch.setenv(name, "")
+        monkeypatch.delenv(name)
+    return tmp_path
+
+
+def compile_model(model_name):
+    # No DiT transformer and no decoder, so only the cache setup runs
+    model = SimpleNamespace(model=SimpleNamespace(), pretransform=None)
+    warmup.compile_model(model, model_name, "torch.compile")
+
+
+def test_cache_dirs_follow_the_loaded_model(compile_cache, monkeypatch):
+    monkeypatch.setattr(warmup, "USER_CACHE_DIRS", [])
+
+    compile_model("first")
+    compile_model("second")
+    assert os.environ["TORCHINDUCTOR_CACHE_DIR"] == str(
+        compile_cache / "second" / "inductor"
+    )
+    assert os.environ["TRITON_CACHE_DIR"] == str(compile_cache / "second" / "triton")
+
+
+def test_user_cache_dirs_are_kept(compile_cache, monkeypatch):
+    monkeypatch.setattr(warmup, "USER_CACHE_DIRS", ["TRITON_CACHE_DIR"])
+    monkeypatch.setenv("TRITON_CACHE_DIR", "/user/triton")
+
+    compile_model("first")
+    assert os.environ["TRITON_CACHE_DIR"] == "/user/triton"
+    assert os.environ["TORCHINDUCTOR_CACHE_DIR"] == str(
+        compile_cache / "first" / "inductor"
+    )
@@ -0,0 +1,54 @@
+import json
+import struct
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from tts_webui_extension.stable_audio.weights import (
+    load_safetensors_mmap,
+    read_safetensors_header,
+)
+
+
+def write_safetensors(path, tensors):
+    header = {"__metadata__": {"format": "pt"}}
+    data = b""
+    for key, (dtype_name, tensor) in tensors.items():
+        raw = tensor.contiguous().view(torch.uint8).numpy().tobytes()
+        header[key] = {
+            "dtype": dtype_name,
+            "shape": list(tensor.shape),
+            "data_offsets": [len(data), len(data) + len(raw)],
+        }
+        data += raw
+    encoded = json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        f.write(data)
+
+
+def test_header_drops_metadata(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    write_safetensors(path, {"weight": ("F32", torch.ones(2, 3))})
+
+    header, data_offset = read_safetensors_header(path)
+    assert list(header) == ["weight"]
+    assert header["weight"]["shape"] == [2, 3]
+    assert data_offset > 8
+
+
+def test_mapped_tensors_match_the_file(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    tensors = {
+        "model.weight": ("F32", torch.arange(6, dtype=torch.float32).reshape(2, 3)),
+        "model.half": ("F16", torch.full((4,), 0.5, dtype=torch.float16)),
+        "model.steps": ("I64", torch.tensor([7, 8])),
+    }
+    write_safetensors(path, tensors)
+
+    state_dict = load_safetensors_mmap(path)
+    for key, (_, tensor) in tensors.items():
+        assert state_dict[key].dtype == tensor.dtype
+        assert torch.equal(state_dict[key], tensor)
@@ -0,0 +1,13 @@
+from tts_webui_extension.stable_audio.worker_pool import split_cores
+
+
+def test_split_cores_contiguous_with_remainder_first():
+    assert split_cores(list(range(7)), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+
+
+def test_split_cores_caps_workers_at_core_count():
+    assert split_cores([4, 5], 8) == [[4], [5]]
+
+
+def test_split_cores_at_least_one_worker():
+    assert split_cores([0, 1, 2], 0) == [[0, 1, 2]]
@@ -0,0 +1,377 @@
+# Headless batch generation from a JSONL manifest
+#
+# Run from the tts_webui root so that data/models/stable-audio resolves:
+#   python -m tts_webui_extension.stable_audio.batch manifest.jsonl --model stabilityai__stable-audio-open-1.0
+#
+# Each manifest line is a JSON object with a "prompt" and any of the
+# generation parameters below, plus an optional "id".
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import multiprocessing as mp
+
+JOB_DEFAULTS = {
+    "negative_prompt": "",
+    "seconds_start": 0,
+    "seconds_total": 30,
+    "cfg_scale": 7.0,
+    "steps": 100,
+    "seed": -1,
+    "sampler_type": "dpmpp-3m-sde",
+    "sigma_min": 0.03,
+    "sigma_max": 500,
+    "cfg_rescale": 0.0,
+    "profile": "Custom",
+    "early_exit_threshold": 0.0,
+    "cfg_mode": "Auto",
+}
+
+# How often the parent checks for workers that died without reporting back
+WORKER_POLL_SECONDS = 5
+
+# Parameters that have to match for jobs to share one diffusion pass
+BATCH_KEYS = [
+    "seconds_start",
+    "seconds_total",
+    "cfg_scale",
+    "steps",
+    "seed",
+    "sampler_type",
+    "sigma_min",
+    "sigma_max",
+    "cfg_rescale",
+    "profile",
+    "early_exit_threshold",
+    "cfg_mode",
+]
+
+
+def read_manifest(path):
+    jobs = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            job = {**JOB_DEFAULTS, **json.loads(line)}
+            if "prompt" not in job:
+                raise Exception(f"Manifest line {line_number} has no prompt")
+            job["id"] = str(job.get("id", line_number))
+            jobs.append(job)
+    return jobs
+
+
+def get_progress_path(manifest_path):
+    return f"{manifest_path}.progress.jsonl"
+
+
+def read_progress(progress_path):
+    done = {}
+    if not os.path.exists(progress_path):
+        return done
+    with open(progress_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write leaves a truncated last line
+                continue
+            done[entry["id"]] = entry["path"]
+    return done
+
+
+def group_jobs(jobs, batch_size):
+    groups = {}
+    for job in jobs:
+        key = tuple(job[k] for k in BATCH_KEYS) + (bool(job["negative_prompt"]),)
+        groups.setdefault(key, []).append(job)
+
+    batches = []
+    for group in groups.values():
+        for i in range(0, len(group), batch_size):
+            batches.append(group[i : i + batch_size])
+    return batches
+
+
+def get_worker_device(worker_index):
+    import torch
+
+    if torch.cuda.is_available():
+        return torch.device(f"cuda:{worker_index % torch.cuda.device_count()}")
+    return torch.device("cpu")
+
+
+def run_batch(batch, timeout=None):
+    import numpy as np
+    from einops import rearrange
+
+    from . import main
+
+    params = {k: batch[0][k] for k in BATCH_KEYS}
+    if int(params["seed"]) == -1:
+        params["seed"] = int(np.random.randint(0, 2**32 - 1, dtype=np.uint32))
+
+    has_negative = bool(batch[0]["negative_prompt"])
+    audio, generation_info = main.generate_cond_batch(
+        prompts=[job["prompt"] for job in batch],
+        negative_prompts=(
+            [job["negative_prompt"] for job in batch] if has_negative else None
+        ),
+        deadline=time.time() + timeout if timeout else None,
+        **params,
+    )
+
+    results = []
+    for index, job in enumerate(batch):
+        item = main.audio_to_int16(audio[index])
+        data = rearrange(item, "d n -> n d").numpy()
+        base_dir = main.write_result(
+            (main.sample_rate, data),
+            job["prompt"],
+            job["negative_prompt"],
+            params["seconds_start"],
+            params["seconds_total"],
+            params["cfg_scale"],
+            params["steps"],
+            0,
+            params["seed"],
+            params["sampler_type"],
+            params["sigma_min"],
+            params["sigma_max"],
+            params["cfg_rescale"],
+            False,
+            None,
+            1.0,
+            name_suffix=f"_{job['id']}",
+            extra_metadata={
+                **generation_info,
+                "batch_index": index,
+                "batch_size": len(batch),
+            },
+        )
+        results.append({"id": job["id"], "path": base_dir})
+    return results
+
+
+def worker_main(worker_index, args, batch_queue, result_queue):
+    import torch
+
+    from . import main
+    from .worker_pool import get_available_cores, split_cores, pin_worker
+
+    try:
+        device = get_worker_device(worker_index)
+        if device.type == "cpu":
+            cores = split_cores(get_available_cores(), args.workers)[worker_index]
+            pin_worker(cores, args.threads)
+        elif args.threads:
+            torch.set_num_threads(args.threads)
+
+        main.load_model_by_name(
+            args.model,
+            model_half=args.half,
+            device=device,
+            mmap_weights=device.type == "cpu",
+            precision=args.precision,
+            compile_mode=args.compile,
+            warmup=args.warmup,
+            offload=args.offload,
+            parallel_load=args.parallel_load,
+        )
+
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                break
+            batch_index, batch = item
+            try:
+                results = run_batch(batch, args.timeout)
+                result_queue.put(("done", (batch_index, results)))
+            except Exception as e:
+                print(f"Worker {worker_index} failed on batch: {e}")
+                result_queue.put(("failed", (batch_index, None)))
+    except Exception as e:
+        print(f"Worker {worker_index} stopped: {e}")
+    finally:
+        # Reports a clean exit, a killed worker is found by the parent polling
+        result_queue.put(("exit", (worker_index, None)))
+
+
+def write_progress(progress_file, results):
+    for result in results:
+        progress_file.write(json.dumps(result) + "\n")
+    progress_file.flush()
+    os.fsync(progress_file.fileno())
+
+
+def run(args):
+    jobs = read_manifest(args.manifest)
+    progress_path = get_progress_path(args.manifest)
+    done = read_progress(progress_path)
+
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"{len(jobs)} jobs in manifest, {len(done)} done, {len(pending)} pending")
+    if not pending:
+        return []
+
+    batches = group_jobs(pending, args.batch_size)
+    failed = []
+
+    with open(progress_path, "a") as progress_file:
+        if args.workers <= 1:
+            from . import main
+
+            main.load_model_by_name(
+                args.model,
+                model_half=args.half,
+                precision=args.precision,
+                compile_mode=args.compile,
+                warmup=args.warmup,
+                offload=args.offload,
+                parallel_load=args.parallel_load,
+            )
+            for batch in batches:
+                try:
+                    write_progress(progress_file, run_batch(batch, args.timeout))
+                except Exception as e:
+                    print(f"Batch failed: {e}")
+                    failed.extend(job["id"] for job in batch)
+        else:
+            # spawn so that each worker initialises torch and CUDA on its own
+            ctx = mp.get_context("spawn")
+            batch_queue = ctx.Queue()
+            result_queue = ctx.Queue()
+            # Batches nobody reports back on, because their worker died or
+            # every worker failed to load, are failed at the end
+            unfinished = dict(enumerate(batches))
+            for item in unfinished.items():
+                batch_queue.put(item)
+            for _ in range(args.workers):
+                batch_queue.put(None)
+            # Batches left behind by dead workers must not block the exit
+            batch_queue.cancel_join_thread()
+
+            workers = [
+                ctx.Process(
+                    target=worker_main,
+                    args=(i, args, batch_queue, result_queue),
+                )
+                for i in range(args.workers)
+            ]
+            for worker in workers:
+                worker.start()
+
+            exited = set()
+            while len(exited) < len(workers) or not result_queue.empty():
+                try:
+                    kind, (index, results) = result_queue.get(
+                        timeout=WORKER_POLL_SECONDS
+                    )
+                except queue.Empty:
+                    for i, worker in enumerate(workers):
+                        if i not in exited and not worker.is_alive():
+                            print(f"Worker {i} died with exit code {worker.exitcode}")
+                            exited.add(i)
+                    continue
+                if kind == "exit":
+                    exited.add(index)
+                    continue
+                batch = unfinished.pop(index)
+                if kind == "done":
+                    write_progress(progress_file, results)
+                else:
+                    failed.extend(job["id"] for job in batch)
+
+            for worker in workers:
+                worker.join()
+            for batch in unfinished.values():
+                failed.extend(job["id"] for job in batch)
+
+    if failed:
+        print(f"{len(failed)} jobs failed, rerun to retry: {failed}")
+    return failed
+
+
+def get_parser():
+    # Imported here so the manifest helpers do not pull in torch
+    from .precision import PRECISION_MODES
+    from .warmup import COMPILE_MODES
+    from .offload import OFFLOAD_MODES
+
+    parser = argparse.ArgumentParser(
+        description="Generate Stable Audio outputs from a JSONL manifest"
+    )
+    parser.add_argument("manifest", help="Path to a JSONL manifest of jobs")
+    parser.add_argument(
+        "--model", required=True, help="Model folder in data/models/stable-audio"
+    )
+    parser.add_argument("--half", action="store_true", help="Load in half precision")
+    parser.add_argument(
+        "--precision",
+        choices=PRECISION_MODES,
+        default="fp32",
+        help="Precision mode, reduced modes are meant for CPU inference",
+    )
+    parser.add_argument(
+        "--compile",
+        choices=COMPILE_MODES,
+        default="none",
+        help="Compile the DiT and decoder, artifacts are cached in the model folder",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Run a tiny generation after loading, before the first job",
+    )
+    parser.add_argument(
+        "--parallel-load",
+        action="store_true",
+        help="Build and load the conditioners, DiT and pretransform in parallel threads",
+    )
+    parser.add_argument(
+        "--offload",
+        choices=OFFLOAD_MODES,
+        default="none",
+        help="Keep only the running component on the device, so more workers fit on one GPU",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=4,
+        help="Maximum number of compatible jobs per diffusion pass",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes, on CPU each is pinned to its own cores",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Torch intra-op threads per worker",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Cancel a batch that takes longer than this many seconds, its jobs are retried on the next run",
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.half and args.precision != "fp32":
+        parser.error(f"--precision {args.precision} needs fp32 weights, drop --half")
+    if run(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Classifier-free guidance execution modes
+#
+# Batched runs the conditional and unconditional passes as one double-size
+# batch (the stable_audio_tools default) and Sequential runs them one after
+# the other to lower peak activation memory. Auto skips the unconditional
+# inputs when guidance has no effect (cfg_scale 1): the DiT already runs a
+# single pass then, so what it saves is encoding the negative prompt.
+from contextlib import contextmanager
+
+CFG_MODES = ["Auto", "Batched", "Sequential"]
+
+
+def resolve_cfg_mode(cfg_mode, cfg_scale):
+    if cfg_mode not in CFG_MODES:
+        raise Exception(f"Unknown CFG mode {cfg_mode}, expected one of {CFG_MODES}")
+    if cfg_mode == "Auto":
+        return "Skip unconditional" if float(cfg_scale) == 1.0 else "Batched"
+    return cfg_mode
+
+
+def make_sequential_forward(forward):
+    # Mirrors the batched CFG in DiffusionTransformer.forward with two calls
+    # that each take its unguided path
+    import torch
+
+    def sequential_forward(
+        x,
+        t,
+        cross_attn_cond=None,
+        cross_attn_cond_mask=None,
+        negative_cross_attn_cond=None,
+        negative_cross_attn_mask=None,
+        prepend_cond=None,
+        cfg_scale=1.0,
+        scale_phi=0.0,
+        **kwargs,
+    ):
+        if cfg_scale == 1.0 or (cross_attn_cond is None and prepend_cond is None):
+            return forward(
+                x,
+                t,
+                cross_attn_cond=cross_attn_cond,
+                cross_attn_cond_mask=cross_attn_cond_mask,
+                negative_cross_attn_cond=negative_cross_attn_cond,
+                negative_cross_attn_mask=negative_cross_attn_mask,
+                prepend_cond=prepend_cond,
+                cfg_scale=cfg_scale,
+                scale_phi=scale_phi,
+                **kwargs,
+            )
+
+        cond_output = forward(
+            x,
+            t,
+            cross_attn_cond=cross_attn_cond,
+            cross_attn_cond_mask=cross_attn_cond_mask,
+            prepend_cond=prepend_cond,
+            **kwargs,
+        )
+
+        uncond_cross_attn_cond = None
+        if cross_attn_cond is not None:
+            uncond_cross_attn_cond = torch.zeros_like(cross_attn_cond)
+            if negative_cross_attn_cond is not None:
+                uncond_cross_attn_cond = negative_cross_attn_cond
+                if negative_cross_attn_mask is not None:
+                    uncond_cross_attn_cond = torch.where(
+                        negative_cross_attn_mask.to(torch.bool).unsqueeze(2),
+                        negative_cross_attn_cond,
+                        torch.zeros_like(cross_attn_cond),
+                    )
+
+        uncond_output = forward(
+            x,
+            t,
+            cross_attn_cond=uncond_cross_attn_cond,
+            cross_attn_cond_mask=cross_attn_cond_mask,
+            prepend_cond=(
+                torch.zeros_like(prepend_cond) if prepend_cond is not None else None
+            ),
+            **kwargs,
+        )
+
+        cfg_output = uncond_output + (cond_output - uncond_output) * cfg_scale
+        del uncond_output
+
+        if scale_phi != 0.0:
+            cond_out_std = cond_output.std(dim=1, keepdim=True)
+            out_cfg_std = cfg_output.std(dim=1, keepdim=True)
+            return (
+                scale_phi * (cfg_output * (cond_out_std / out_cfg_std))
+                + (1 - scale_phi) * cfg_output
+            )
+        return cfg_output
+
+    return sequential_forward
+
+
+@contextmanager
+def cfg_execution(model, cfg_mode):
+    transformer = getattr(model.model, "model", None)
+    if cfg_mode != "Sequential":
+        yield
+        return
+    if not hasattr(transformer, "_forward"):
+        print("Sequential CFG is only supported for DiT models, using batched CFG")
+        yield
+        return
+
+    transformer.forward = make_sequential_forward(transformer.forward)  # type: ignore
+    try:
+        yield
+    finally:
+        del transformer.forward  # type: ignore
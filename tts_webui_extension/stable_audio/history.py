@@ -0,0 +1,214 @@
+# Generation history index
+#
+# Every saved result is appended to a SQLite database next to the outputs,
+# so past generations can be searched by prompt, model and date and
+# duplicate parameter sets found without walking the output folders.
+# Folders written before the index existed are picked up by backfill().
+# Prompts are searched through an FTS5 table kept in sync by a trigger.
+import os
+import json
+import time
+import wave
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    date TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    seed TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    params TEXT,
+    params_hash TEXT,
+    audio_hash TEXT,
+    indexed_at REAL
+);
+CREATE INDEX IF NOT EXISTS generations_model ON generations (model);
+CREATE INDEX IF NOT EXISTS generations_date ON generations (date);
+CREATE INDEX IF NOT EXISTS generations_params_hash ON generations (params_hash);
+CREATE INDEX IF NOT EXISTS generations_audio_hash ON generations (audio_hash);
+DROP INDEX IF EXISTS generations_prompt;
+CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5 (
+    prompt, content='generations', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS generations_fts_insert AFTER INSERT ON generations
+BEGIN
+    INSERT INTO generations_fts (rowid, prompt) VALUES (new.id, new.prompt);
+END;
+"""
+
+# Metadata that differs between otherwise identical generations
+VOLATILE_KEYS = [
+    "date",
+    "steps_used",
+    "stop_reason",
+    "batch_index",
+    "batch_size",
+    "peak_memory_mb",
+]
+
+
+def get_db_path():
+    from .main import OUTPUT_DIR
+
+    return os.path.join(OUTPUT_DIR, "history.sqlite")
+
+
+@contextmanager
+def connect():
+    path = get_db_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        has_fts = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'generations_fts'"
+        ).fetchone()
+        connection.executescript(SCHEMA)
+        if not has_fts:
+            # Indexes the prompts of a database made before the search table
+            connection.execute(
+                "INSERT INTO generations_fts (generations_fts) VALUES ('rebuild')"
+            )
+            connection.commit()
+        yield connection
+    finally:
+        connection.close()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_params(params):
+    stable = {k: v for k, v in params.items() if k not in VOLATILE_KEYS}
+    encoded = json.dumps(stable, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def read_wav_info(path):
+    with wave.open(path, "rb") as wav_file:
+        sample_rate = wav_file.getframerate()
+        return sample_rate, wav_file.getnframes() / sample_rate
+
+
+def make_row(wav_path, params):
+    sample_rate, duration = read_wav_info(wav_path)
+    return (
+        wav_path,
+        params.get("date"),
+        params.get("prompt"),
+        params.get("negative_prompt"),
+        params.get("model"),
+        str(params.get("seed_textbox", params.get("seed"))),
+        duration,
+        sample_rate,
+        json.dumps(params, default=str),
+        hash_params(params),
+        hash_file(wav_path),
+        time.time(),
+    )
+
+
+def insert_rows(connection, rows):
+    connection.executemany(
+        """
+        INSERT OR IGNORE INTO generations (
+            path, date, prompt, negative_prompt, model, seed, duration,
+            sample_rate, params, params_hash, audio_hash, indexed_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    connection.commit()
+
+
+def add_result(wav_path, params):
+    with connect() as connection:
+        insert_rows(connection, [make_row(wav_path, params)])
+
+
+def backfill():
+    from .main import OUTPUT_DIR
+
+    if not os.path.isdir(OUTPUT_DIR):
+        return 0
+
+    with connect() as connection:
+        known = {row[0] for row in connection.execute("SELECT path FROM generations")}
+        rows = []
+        for name in sorted(os.listdir(OUTPUT_DIR)):
+            wav_path = os.path.join(OUTPUT_DIR, name, f"{name}.wav")
+            json_path = os.path.join(OUTPUT_DIR, name, f"{name}.json")
+            if wav_path in known or not os.path.exists(json_path):
+                continue
+            if not os.path.exists(wav_path):
+                continue
+            try:
+                with open(json_path) as f:
+                    rows.append(make_row(wav_path, json.load(f)))
+            except Exception as e:
+                print(f"Skipping {name}: {e}")
+        insert_rows(connection, rows)
+    print(f"Indexed {len(rows)} existing results")
+    return len(rows)
+
+
+def get_prompt_query(prompt):
+    # Every word has to appear in the prompt, as a whole word or its start
+    words = prompt.split()
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def search(prompt="", model="", date_from="", date_to="", limit=200):
+    query = "SELECT date, prompt, model, seed, duration, path FROM generations"
+    conditions = []
+    args = []
+    if prompt.strip():
+        conditions.append(
+            "id IN (SELECT rowid FROM generations_fts WHERE generations_fts MATCH ?)"
+        )
+        args.append(get_prompt_query(prompt))
+    if model:
+        conditions.append("model = ?")
+        args.append(model)
+    if date_from:
+        conditions.append("date >= ?")
+        args.append(date_from)
+    if date_to:
+        # Dates are stored as YYYY-MM-DD_HH-MM-SS, "~" sorts after all of
+        # them so every result from the "to" day (or minute, ...) is included
+        conditions.append("date <= ?")
+        args.append(f"{date_to}~")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY date DESC LIMIT ?"
+    args.append(int(limit))
+
+    with connect() as connection:
+        return connection.execute(query, args).fetchall()
+
+
+def find_duplicates(limit=200):
+    with connect() as connection:
+        return connection.execute(
+            """
+            SELECT prompt, model, seed, COUNT(*) AS copies, GROUP_CONCAT(path, '\n')
+            FROM generations
+            GROUP BY params_hash
+            HAVING copies > 1
+            ORDER BY copies DESC
+            LIMIT ?
+            """,
+            (int(limit),),
+        ).fetchall()
@@ -0,0 +1,349 @@
+# Binary HTTP generation API
+#
+# A small FastAPI app served from a background thread of the webui process,
+# so it uses the already loaded model (or the worker pool when it runs).
+# Audio is returned as WAV or raw little-endian int16 PCM bytes, with the
+# format described in the response headers, instead of going through the
+# Gradio JSON/file round trips.
+#
+#   POST /generate              generate and return the audio
+#   POST /jobs                  queue a generation, returns a job id
+#   GET  /jobs/{job_id}         job status
+#   GET  /jobs/{job_id}/audio   audio of a finished job
+#   DELETE /jobs/{job_id}       cancel a queued or running job
+#   GET  /metrics               generation outcome counts
+#
+# A /generate caller that disconnects, or a request past its
+# timeout_seconds, is cancelled at the next sampler step.
+import time
+import uuid
+import struct
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from .sampling_control import (
+    SAMPLER_TYPES,
+    PROFILE_CHOICES,
+    GenerationCancelled,
+    count,
+    get_metrics,
+)
+from .cfg_modes import CFG_MODES
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Generations run at once when the worker pool is not running at start
+DEFAULT_CONCURRENT_REQUESTS = 4
+MAX_STORED_JOBS = 100
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = ""
+    seconds_start: float = Field(0, ge=0)
+    seconds_total: float = Field(30, gt=0)
+    cfg_scale: float = Field(7.0, ge=0)
+    steps: int = Field(100, ge=1, le=1000)
+    seed: int = -1
+    sampler_type: Literal[tuple(SAMPLER_TYPES)] = "dpmpp-3m-sde"  # type: ignore
+    sigma_min: float = 0.03
+    sigma_max: float = 500
+    cfg_rescale: float = Field(0.0, ge=0, le=1)
+    profile: Literal[tuple(PROFILE_CHOICES)] = "Custom"  # type: ignore
+    early_exit_threshold: float = Field(0.0, ge=0)
+    cfg_mode: Literal[tuple(CFG_MODES)] = "Auto"  # type: ignore
+    batch_size: int = Field(1, ge=1, le=16)
+    # Includes the time spent queued, 0 = no deadline
+    timeout_seconds: float = Field(0, ge=0)
+    format: Literal["wav", "pcm"] = "wav"
+    stream: bool = False
+
+
+def get_deadline(request):
+    if not request.timeout_seconds:
+        return None
+    return time.time() + request.timeout_seconds
+
+
+def run_generation(request, cancel_event=None, deadline=None):
+    from . import main, worker_pool
+
+    seed = request.seed
+    if seed == -1:
+        seed = int(np.random.randint(0, 2**32 - 1, dtype=np.uint32))
+
+    job = {
+        "prompts": [request.prompt] * request.batch_size,
+        "negative_prompts": (
+            [request.negative_prompt] * request.batch_size
+            if request.negative_prompt
+            else None
+        ),
+        "seconds_start": request.seconds_start,
+        "seconds_total": request.seconds_total,
+        "cfg_scale": request.cfg_scale,
+        "steps": request.steps,
+        "seed": seed,
+        "sampler_type": request.sampler_type,
+        "sigma_min": request.sigma_min,
+        "sigma_max": request.sigma_max,
+        "cfg_rescale": request.cfg_rescale,
+        "profile": request.profile,
+        "early_exit_threshold": request.early_exit_threshold,
+        "cfg_mode": request.cfg_mode,
+        "deadline": deadline,
+    }
+
+    if worker_pool.pool is not None:
+        (sr, data), info = worker_pool.pool.generate(cancel_event=cancel_event, **job)
+    else:
+        from stable_audio_tools.interface.gradio import model
+
+        if model is None:
+            raise Exception("Model not loaded")
+        with main.model_lock:
+            (sr, data), info = worker_pool.generate_job(
+                job, cancel_event.is_set if cancel_event is not None else None
+            )
+
+    return sr, data, {"seed": seed, **info}
+
+
+def wav_header(sr, channels, num_frames):
+    data_size = num_frames * channels * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        channels,
+        sr,
+        sr * channels * 2,
+        channels * 2,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def iter_audio_chunks(sr, data, audio_format):
+    # The header only needs the length, so the samples are converted one
+    # chunk at a time instead of building the whole body first
+    if audio_format == "wav":
+        yield wav_header(sr, data.shape[1], data.shape[0])
+    frames_per_chunk = max(1, STREAM_CHUNK_SIZE // (2 * data.shape[1]))
+    for i in range(0, data.shape[0], frames_per_chunk):
+        yield data[i : i + frames_per_chunk].astype("<i2").tobytes()
+
+
+def encode_audio(sr, data, audio_format):
+    return b"".join(iter_audio_chunks(sr, data, audio_format))
+
+
+def audio_response(sr, data, info, audio_format, stream=False):
+    headers = {
+        "X-Sample-Rate": str(sr),
+        "X-Channels": str(data.shape[1]),
+        "X-Sample-Format": "s16le",
+        "X-Seed": str(info["seed"]),
+        "X-Steps-Used": str(info.get("steps_used", "")),
+    }
+    media_type = "audio/wav" if audio_format == "wav" else "audio/L16"
+
+    if stream:
+        return StreamingResponse(
+            iter_audio_chunks(sr, data, audio_format),
+            media_type=media_type,
+            headers=headers,
+        )
+    return Response(
+        encode_audio(sr, data, audio_format), media_type=media_type, headers=headers
+    )
+
+
+def get_concurrent_requests(max_concurrent=0):
+    from . import worker_pool
+
+    max_concurrent = int(max_concurrent or 0)
+    if max_concurrent > 0:
+        return max_concurrent
+    if worker_pool.pool is not None:
+        return len(worker_pool.pool.workers)
+    return DEFAULT_CONCURRENT_REQUESTS
+
+
+def create_app(max_concurrent=DEFAULT_CONCURRENT_REQUESTS):
+    app = FastAPI(title="Stable Audio API")
+    # Several threads so requests reach the worker pool in parallel, the
+    # in-process model still takes them one at a time through model_lock
+    executor = ThreadPoolExecutor(max_workers=max_concurrent)
+    jobs = OrderedDict()
+    jobs_lock = threading.Lock()
+
+    def store_job(job_id, **fields):
+        with jobs_lock:
+            jobs.setdefault(job_id, {}).update(fields)
+            # Oldest finished jobs first, queued and running ones are kept
+            finished = [
+                key
+                for key, job in jobs.items()
+                if job["status"] not in ["queued", "running"]
+            ]
+            for key in finished[: max(0, len(jobs) - MAX_STORED_JOBS)]:
+                del jobs[key]
+
+    def run_job(job_id, request, cancel_event, deadline):
+        if cancel_event.is_set():
+            # Cancelled while queued, never reaches the model
+            count("cancelled")
+            return
+        store_job(job_id, status="running", started=time.time())
+        try:
+            result = run_generation(request, cancel_event, deadline)
+            store_job(job_id, status="done", finished=time.time(), result=result)
+        except GenerationCancelled as e:
+            store_job(job_id, status=e.reason, finished=time.time())
+        except Exception as e:
+            store_job(job_id, status="failed", finished=time.time(), error=repr(e))
+
+    @app.post("/generate")
+    async def generate(request: GenerateRequest, http_request: Request):
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        task = loop.run_in_executor(
+            executor, run_generation, request, cancel_event, get_deadline(request)
+        )
+        while not task.done():
+            await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if not task.done() and await http_request.is_disconnected():
+                cancel_event.set()
+        try:
+            sr, data, info = task.result()
+        except GenerationCancelled as e:
+            status_code = 504 if e.reason == "deadline_exceeded" else 499
+            raise HTTPException(status_code=status_code, detail=e.reason)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=repr(e))
+        return audio_response(sr, data, info, request.format, request.stream)
+
+    @app.post("/jobs")
+    async def submit_job(request: GenerateRequest):
+        job_id = uuid.uuid4().hex
+        cancel_event = threading.Event()
+        store_job(
+            job_id,
+            status="queued",
+            created=time.time(),
+            request=request,
+            cancel_event=cancel_event,
+        )
+        executor.submit(run_job, job_id, request, cancel_event, get_deadline(request))
+        return {"job_id": job_id, "status": "queued"}
+
+    @app.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str):
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Unknown job")
+            if job["status"] in ["queued", "running"]:
+                job["cancel_event"].set()
+                if job["status"] == "queued":
+                    job.update(status="cancelled", finished=time.time())
+            status = job["status"]
+        return {"job_id": job_id, "status": status}
+
+    @app.get("/metrics")
+    async def metrics():
+        return get_metrics()
+
+    @app.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        with jobs_lock:
+            job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        status = {
+            k: job[k]
+            for k in ["status", "created", "started", "finished", "error"]
+            if k in job
+        }
+        if "result" in job:
+            status["info"] = job["result"][2]
+        return {"job_id": job_id, **status}
+
+    @app.get("/jobs/{job_id}/audio")
+    async def get_job_audio(job_id: str, stream: bool = False):
+        with jobs_lock:
+            job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        if job["status"] != "done":
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+        sr, data, info = job["result"]
+        return audio_response(sr, data, info, job["request"].format, stream)
+
+    return app
+
+
+server = None
+server_thread = None
+
+SERVER_START_TIMEOUT_SECONDS = 10
+SERVER_STOP_TIMEOUT_SECONDS = 10
+
+
+def start_server(host="127.0.0.1", port=7871, max_concurrent=0):
+    global server, server_thread
+    import uvicorn
+
+    stop_server()
+    max_concurrent = get_concurrent_requests(max_concurrent)
+    config = uvicorn.Config(
+        create_app(max_concurrent), host=host, port=int(port), log_level="info"
+    )
+    server = uvicorn.Server(config)
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+
+    # A failed bind makes uvicorn log the error and return from run()
+    deadline = time.time() + SERVER_START_TIMEOUT_SECONDS
+    while not server.started and server_thread.is_alive():
+        if time.time() > deadline:
+            break
+        time.sleep(0.05)
+    if not server.started:
+        stop_server()
+        raise Exception(
+            f"Stable Audio API failed to start on {host}:{int(port)}, see the console"
+        )
+    return (
+        f"Stable Audio API listening on http://{host}:{int(port)},"
+        f" {max_concurrent} generations at a time"
+    )
+
+
+def stop_server():
+    global server, server_thread
+
+    if server is not None:
+        server.should_exit = True
+        # Wait for the socket to be released before the port is bound again
+        server_thread.join(SERVER_STOP_TIMEOUT_SECONDS)
+        if server_thread.is_alive():
+            server.force_exit = True
+            server_thread.join(SERVER_STOP_TIMEOUT_SECONDS)
+        server = None
+        server_thread = None
+    return "Stable Audio API stopped"
@@ -0,0 +1,189 @@
+# Long-form generation through windowed continuation
+#
+# The piece is generated one model window at a time. Every window after the
+# first is an inpainting pass whose first `overlap` seconds are the tail of
+# the previous window, so the model continues from it. Windows are
+# crossfaded over the overlap and written to the WAV file as they finish,
+# which keeps peak memory at one window regardless of the total duration.
+import os
+import json
+import math
+import wave
+
+from . import history
+
+
+def to_int16(audio):
+    import torch
+
+    # No per-window peak normalisation, it would make the loudness jump
+    # between windows
+    return audio.float().clamp(-1, 1).mul(32767).to(torch.int16)
+
+
+def count_windows(total_n, window_n, overlap_n):
+    # Every window after the first adds window_n - overlap_n new samples
+    step_n = window_n - overlap_n
+    return 1 + max(0, math.ceil((total_n - window_n) / step_n))
+
+
+def crossfade(tail, audio, overlap_n):
+    import torch
+
+    fade = torch.linspace(0, 1, overlap_n)
+    blended = tail * (1 - fade) + audio[:, :overlap_n] * fade
+    return torch.cat([blended, audio[:, overlap_n:]], dim=-1)
+
+
+def write_frames(wav_file, audio):
+    wav_file.writeframes(audio.transpose(0, 1).contiguous().numpy().tobytes())
+
+
+def generate_longform(
+    prompt,
+    negative_prompt=None,
+    duration=120,
+    overlap=10,
+    cfg_scale=7.0,
+    steps=100,
+    seed=-1,
+    sampler_type="dpmpp-3m-sde",
+    sigma_min=0.03,
+    sigma_max=500,
+    cfg_rescale=0.0,
+    profile="Custom",
+    cfg_mode="Auto",
+    is_cancelled=None,
+):
+    import numpy as np
+    from tts_webui.utils.date import get_date_string
+    from tts_webui.utils.prompt_to_title import prompt_to_title
+
+    from . import main
+    from .sampling_control import GenerationCancelled
+
+    window_n = main.sample_size
+    window_seconds = window_n / main.sample_rate
+    overlap_n = int(overlap * main.sample_rate)
+    total_n = int(duration * main.sample_rate)
+
+    if not 0 < overlap_n < window_n // 2:
+        raise Exception(
+            f"Overlap must be between 0 and {window_seconds / 2:.1f} seconds"
+        )
+
+    seed = int(seed)
+    if seed == -1:
+        seed = int(np.random.randint(0, 2**31 - 1))
+
+    num_windows = count_windows(total_n, window_n, overlap_n)
+
+    name = f"{get_date_string()}_{prompt_to_title(prompt)}_longform"
+    base_dir = os.path.join(main.OUTPUT_DIR, name)
+    os.makedirs(base_dir, exist_ok=True)
+    wav_path = os.path.join(base_dir, f"{name}.wav")
+
+    written = 0
+    tail = None
+    windows = []
+
+    with wave.open(wav_path, "wb") as wav_file:
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(main.sample_rate)
+
+        for index in range(num_windows):
+            print(f"Long-form window {index + 1}/{num_windows}")
+
+            init_audio = None
+            mask_args = None
+            if tail is not None:
+                # Keep the previous tail, regenerate everything after it
+                init_audio = (
+                    main.sample_rate,
+                    to_int16(tail).transpose(0, 1).numpy(),
+                )
+                mask_args = {
+                    "cropfrom": 0,
+                    "pastefrom": 0,
+                    "pasteto": 100,
+                    "maskstart": overlap_n / window_n * 100,
+                    "maskend": 100,
+                    "softnessL": 0,
+                    "softnessR": 0,
+                    "marination": 0,
+                }
+
+            remaining_seconds = (total_n - written) / main.sample_rate
+            if tail is not None:
+                remaining_seconds += overlap
+
+            try:
+                audio, info = main.generate_cond_batch(
+                    prompts=[prompt],
+                    negative_prompts=[negative_prompt] if negative_prompt else None,
+                    seconds_start=0,
+                    seconds_total=min(window_seconds, math.ceil(remaining_seconds)),
+                    cfg_scale=cfg_scale,
+                    steps=steps,
+                    seed=seed + index,
+                    sampler_type=sampler_type,
+                    sigma_min=sigma_min,
+                    sigma_max=sigma_max,
+                    cfg_rescale=cfg_rescale,
+                    init_audio=init_audio,
+                    mask_args=mask_args,
+                    profile=profile,
+                    cfg_mode=cfg_mode,
+                    is_cancelled=is_cancelled,
+                )
+            except GenerationCancelled:
+                # The finished windows stay in the WAV file
+                print(
+                    f"Long-form generation cancelled, kept "
+                    f"{written / main.sample_rate:.1f}s in {wav_path}"
+                )
+                raise
+            audio = audio[0].float().cpu()
+            windows.append({"seed": seed + index, **info})
+
+            if index == 0:
+                wav_file.setnchannels(audio.shape[0])
+
+            if tail is not None:
+                audio = crossfade(tail, audio, overlap_n)
+
+            if index == num_windows - 1:
+                write_frames(wav_file, to_int16(audio[:, : total_n - written]))
+                written += min(audio.shape[-1], total_n - written)
+            else:
+                write_frames(wav_file, to_int16(audio[:, :-overlap_n]))
+                written += audio.shape[-1] - overlap_n
+                tail = audio[:, -overlap_n:]
+
+            del audio
+
+    metadata = {
+        "date": get_date_string(),
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "model": main.loaded_model_name,
+        "duration": duration,
+        "overlap": overlap,
+        "cfg_scale": cfg_scale,
+        "steps": steps,
+        "seed": seed,
+        "sampler_type": sampler_type,
+        "sigma_min": sigma_min,
+        "sigma_max": sigma_max,
+        "cfg_rescale": cfg_rescale,
+        "windows": windows,
+    }
+    with open(os.path.join(base_dir, f"{name}.json"), "w") as outfile:
+        json.dump(metadata, outfile, indent=2)
+
+    try:
+        history.add_result(wav_path, metadata)
+    except Exception as e:
+        print(f"Failed to index {name} in the history: {e}")
+
+    return wav_path
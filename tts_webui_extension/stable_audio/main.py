@@ -1,5 +1,8 @@
 import os
 import json
+import time
+import threading
+from contextlib import contextmanager
 from gradio_iconbutton import IconButton
 import numpy as np
 import torch
@@ -13,85 +16,121 @@ from tts_webui.utils.torch_clear_memory import torch_clear_memory
 from tts_webui.utils.prompt_to_title import prompt_to_title
 from tts_webui.utils.OpenFolderButton import OpenFolderButton
 
+from .sampling_control import (
+    SAMPLER_TYPES,
+    PROFILE_CHOICES,
+    GenerationCancelled,
+)
+from .cfg_modes import CFG_MODES
+from .precision import (
+    PRECISION_MODES,
+    apply_precision,
+    precision_autocast,
+    run_precision_check,
+)
+from .warmup import COMPILE_MODES, compile_model, warm_up
+from .offload import OFFLOAD_MODES, apply_offload, get_execution_device
+from . import history
+
 LOCAL_DIR_BASE = os.path.join("data", "models", "stable-audio")
 LOCAL_DIR_BASE_ABSOLUTE = get_path_from_root(*LOCAL_DIR_BASE.split(os.path.sep))
 OUTPUT_DIR = os.path.join("outputs-rvc", "Stable Audio")
 
-
-def generate_cond(
-    prompt,
-    negative_prompt=None,
+model_lock = threading.Lock()
+
+# Precision mode of the loaded model, see precision.py
+precision_mode = "fp32"
+# Cold and warm latency of the last load's warm-up, see warmup.py
+warmup_report = None
+# Weights resident with and without offloading, see offload.py
+offload_report = None
+# Per-component load times of the last parallel load, see parallel_load.py
+load_report = None
+# Arguments of the last load_model_by_name call, so it can be restored
+load_options = None
+# Folder name of the loaded model, recorded with saved results
+loaded_model_name = None
+# Cancel events of the generations each browser session is running
+active_generations = {}
+active_generations_lock = threading.Lock()
+
+
+def generate_cond_batch(
+    prompts,
+    negative_prompts=None,
     seconds_start=0,
     seconds_total=30,
     cfg_scale=6.0,
     steps=250,
-    preview_every=None,
     seed=-1,
     sampler_type="dpmpp-3m-sde",
     sigma_min=0.03,
     sigma_max=1000,
     cfg_rescale=0.0,
-    use_init=False,
     init_audio=None,
     init_noise_level=1.0,
-    mask_cropfrom=None,
-    mask_pastefrom=None,
-    mask_pasteto=None,
-    mask_maskstart=None,
-    mask_maskend=None,
-    mask_softnessL=None,
-    mask_softnessR=None,
-    mask_marination=None,
-    batch_size=1,
+    mask_args=None,
+    callback=None,
+    profile="Custom",
+    early_exit_threshold=0.0,
+    cfg_mode="Auto",
+    is_cancelled=None,
+    deadline=None,
 ):
+    # One diffusion pass for a list of prompts, returns audio as [b, d, n]
+    # together with a dict describing how the sampling went
     import gc
-    import torchaudio
-    from einops import rearrange
     from torchaudio import transforms as T
-    from aeiou.viz import audio_spectrogram_image
 
     from stable_audio_tools.interface.gradio import model
     from stable_audio_tools.inference.generation import generate_diffusion_cond
 
+    from .sampling_control import (
+        resolve_steps,
+        SamplingMonitor,
+        StopSampling,
+        count,
+    )
+    from .cfg_modes import resolve_cfg_mode, cfg_execution
+
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
     gc.collect()
 
-    print(f"Prompt: {prompt}")
+    for prompt in prompts:
+        print(f"Prompt: {prompt}")
 
-    global preview_images
-    preview_images = []
-    if preview_every == 0:
-        preview_every = None
+    cfg_mode = resolve_cfg_mode(cfg_mode, cfg_scale)
+    if cfg_mode == "Skip unconditional":
+        # Guidance is off, so the negative prompt has no effect on the output
+        negative_prompts = None
 
-    # Return fake stereo audio
     conditioning = [
         {
             "prompt": prompt,
             "seconds_start": seconds_start,
             "seconds_total": seconds_total,
         }
-    ] * batch_size
+        for prompt in prompts
+    ]
 
-    if negative_prompt:
+    if negative_prompts:
         negative_conditioning = [
             {
                 "prompt": negative_prompt,
                 "seconds_start": seconds_start,
                 "seconds_total": seconds_total,
             }
-        ] * batch_size
+            for negative_prompt in negative_prompts
+        ]
     else:
         negative_conditioning = None
 
     # Get the device from the model
-    device = next(model.parameters()).device
+    device = get_execution_device(model)
 
     seed = int(seed)
 
-    if not use_init:
-        init_audio = None
-
     input_sample_size = sample_size
 
     if init_audio is not None:
@@ -119,8 +158,133 @@ def generate_cond(
 
         init_audio = (sample_rate, init_audio)
 
+    steps = resolve_steps(profile, sampler_type, steps)
+    monitor = SamplingMonitor(
+        steps, early_exit_threshold, callback, is_cancelled, deadline, sampler_type
+    )
+
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    # Do the audio generation
+    cancelled_reason = None
+    try:
+        monitor.check_cancelled()
+        with precision_autocast(precision_mode, device), cfg_execution(model, cfg_mode):
+            audio = generate_diffusion_cond(
+                model,
+                conditioning=conditioning,  # type: ignore
+                negative_conditioning=negative_conditioning,  # type: ignore
+                steps=steps,
+                cfg_scale=cfg_scale,  # type: ignore
+                batch_size=len(prompts),
+                sample_size=input_sample_size,  # type: ignore
+                sample_rate=sample_rate,
+                seed=seed,
+                device=device,  # type: ignore
+                sampler_type=sampler_type,
+                sigma_min=sigma_min,
+                sigma_max=sigma_max,
+                init_audio=init_audio,
+                init_noise_level=init_noise_level,
+                mask_args=mask_args,
+                callback=monitor,
+                scale_phi=cfg_rescale,
+            )
+    except GenerationCancelled as cancelled:
+        cancelled_reason = cancelled.reason
+    except StopSampling as stop:
+        # Use the model's current estimate of the clean latents as the result
+        monitor.stop_reason = stop.reason
+        audio = stop.denoised
+        if model.pretransform is not None:
+            audio = audio.to(next(model.pretransform.parameters()).dtype)
+            with precision_autocast(precision_mode, device):
+                audio = model.pretransform.decode(audio)
+
+    if cancelled_reason is not None:
+        # Raised outside the except block so the sampler frames, and the
+        # latents they hold, are released before the memory is cleared
+        print(f"Generation {cancelled_reason} at step {monitor.steps_used}/{steps}")
+        count(cancelled_reason, monitor.steps_used)
+        del conditioning, negative_conditioning, init_audio
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        raise GenerationCancelled(cancelled_reason, monitor.steps_used)
+
+    count(monitor.stop_reason or "completed", monitor.steps_used)
+    info = {
+        "profile": profile,
+        "cfg_mode": cfg_mode,
+        "precision": precision_mode,
+        # Worker pool results are saved by the parent, which may have another
+        # model loaded, so the model travels with the result
+        "model": loaded_model_name,
+        "offload": offload_report["mode"] if offload_report else "none",
+        **monitor.get_info(),
+    }
+    if device.type == "cuda":
+        info["peak_memory_mb"] = round(torch.cuda.max_memory_allocated(device) / 2**20)
+    return audio, info
+
+
+def audio_to_int16(audio):
+    return (
+        audio.to(torch.float32)
+        .div(torch.max(torch.abs(audio)))
+        .clamp(-1, 1)
+        .mul(32767)
+        .to(torch.int16)
+        .cpu()
+    )
+
+
+def generate_cond(
+    prompt,
+    negative_prompt=None,
+    seconds_start=0,
+    seconds_total=30,
+    cfg_scale=6.0,
+    steps=250,
+    preview_every=None,
+    seed=-1,
+    sampler_type="dpmpp-3m-sde",
+    sigma_min=0.03,
+    sigma_max=1000,
+    cfg_rescale=0.0,
+    use_init=False,
+    init_audio=None,
+    init_noise_level=1.0,
+    mask_cropfrom=None,
+    mask_pastefrom=None,
+    mask_pasteto=None,
+    mask_maskstart=None,
+    mask_maskend=None,
+    mask_softnessL=None,
+    mask_softnessR=None,
+    mask_marination=None,
+    batch_size=1,
+    profile="Custom",
+    early_exit_threshold=0.0,
+    cfg_mode="Auto",
+    is_cancelled=None,
+    deadline=None,
+):
+    from einops import rearrange
+    from aeiou.viz import audio_spectrogram_image
+
+    from stable_audio_tools.interface.gradio import model
+
+    # Local to the request, generations run concurrently
+    preview_images = []
+    if preview_every == 0:
+        preview_every = None
+
+    if not use_init:
+        init_audio = None
+
     def progress_callback(callback_info):
-        global preview_images
         denoised = callback_info["denoised"]
         current_step = callback_info["i"]
         sigma = callback_info["sigma"]
@@ -137,44 +301,42 @@ def generate_cond(
                 (audio_spectrogram, f"Step {current_step} sigma={sigma:.3f})")
             )
 
-    # Do the audio generation
-    audio = generate_diffusion_cond(
-        model,
-        conditioning=conditioning,  # type: ignore
-        negative_conditioning=negative_conditioning,  # type: ignore
+    audio, generation_info = generate_cond_batch(
+        prompts=[prompt] * batch_size,
+        negative_prompts=[negative_prompt] * batch_size if negative_prompt else None,
+        seconds_start=seconds_start,
+        seconds_total=seconds_total,
+        cfg_scale=cfg_scale,
         steps=steps,
-        cfg_scale=cfg_scale,  # type: ignore
-        batch_size=batch_size,
-        sample_size=input_sample_size,  # type: ignore
-        sample_rate=sample_rate,
         seed=seed,
-        device=device,  # type: ignore
         sampler_type=sampler_type,
         sigma_min=sigma_min,
         sigma_max=sigma_max,
+        cfg_rescale=cfg_rescale,
         init_audio=init_audio,
         init_noise_level=init_noise_level,
-        # mask_args=mask_args,
         callback=progress_callback if preview_every is not None else None,
-        scale_phi=cfg_rescale,
+        profile=profile,
+        early_exit_threshold=early_exit_threshold,
+        cfg_mode=cfg_mode,
+        is_cancelled=is_cancelled,
+        deadline=deadline,
     )
 
-    # Convert to WAV file
+    # Convert to 16-bit audio
     audio = rearrange(audio, "b d n -> d (b n)")
-    audio = (
-        audio.to(torch.float32)
-        .div(torch.max(torch.abs(audio)))
-        .clamp(-1, 1)
-        .mul(32767)
-        .to(torch.int16)
-        .cpu()
-    )
-    torchaudio.save("output.wav", audio, sample_rate)
+    audio = audio_to_int16(audio)
 
     # Let's look at a nice spectrogram too
     audio_spectrogram = audio_spectrogram_image(audio, sample_rate=sample_rate)
 
-    return ("output.wav", [audio_spectrogram, *preview_images])
+    # Returned as an array rather than a shared output file, so concurrent
+    # requests cannot pick up each other's audio
+    return (
+        (sample_rate, rearrange(audio, "d n -> n d").numpy()),
+        [audio_spectrogram, *preview_images],
+        generation_info,
+    )
 
 
 def generate_cond_lazy(
@@ -193,6 +355,10 @@ def generate_cond_lazy(
     use_init=False,
     init_audio=None,
     init_noise_level=1.0,
+    profile="Custom",
+    early_exit_threshold=0.0,
+    cfg_mode="Auto",
+    deadline_seconds=0,
     mask_cropfrom=None,
     mask_pastefrom=None,
     mask_pasteto=None,
@@ -202,39 +368,143 @@ def generate_cond_lazy(
     mask_softnessR=None,
     mask_marination=None,
     batch_size=1,
+    request: gr.Request = None,  # type: ignore
 ):
     from stable_audio_tools.interface.gradio import model
 
-    if model is None:
-        gr.Error("Model not loaded")
-        raise Exception("Model not loaded")
+    from . import worker_pool
 
-    return generate_cond(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        seconds_start=seconds_start,
-        seconds_total=seconds_total,
-        cfg_scale=cfg_scale,
-        steps=steps,
-        preview_every=preview_every,
-        seed=seed,
-        sampler_type=sampler_type,
-        sigma_min=sigma_min,
-        sigma_max=sigma_max,
-        cfg_rescale=cfg_rescale,
-        use_init=use_init,
+    deadline = time.time() + deadline_seconds if deadline_seconds else None
+
+    if worker_pool.pool is not None:
+        # The sampler callback and the masks are not sent to the workers
+        if preview_every:
+            raise gr.Error(
+                "Previews are not available while the worker pool is running,"
+                " set Preview Every to 0"
+            )
+        masks = [
+            mask_cropfrom,
+            mask_pastefrom,
+            mask_pasteto,
+            mask_maskstart,
+            mask_maskend,
+            mask_softnessL,
+            mask_softnessR,
+            mask_marination,
+        ]
+        if any(mask is not None for mask in masks):
+            raise gr.Error(
+                "Inpainting is not available while the worker pool is running"
+            )
+
+    with track_generation(request) as cancel_event:
+        if worker_pool.pool is not None:
+            return generate_cond_pool(
+                worker_pool.pool,
+                cancel_event=cancel_event,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                seconds_start=seconds_start,
+                seconds_total=seconds_total,
+                cfg_scale=cfg_scale,
+                steps=steps,
+                seed=seed,
+                sampler_type=sampler_type,
+                sigma_min=sigma_min,
+                sigma_max=sigma_max,
+                cfg_rescale=cfg_rescale,
+                init_audio=init_audio if use_init else None,
+                init_noise_level=init_noise_level,
+                batch_size=batch_size,
+                profile=profile,
+                early_exit_threshold=early_exit_threshold,
+                cfg_mode=cfg_mode,
+                deadline=deadline,
+            )
+
+        if model is None:
+            gr.Error("Model not loaded")
+            raise Exception("Model not loaded")
+
+        # Requests run concurrently so the worker pool can serve them in
+        # parallel, the in-process model still takes them one at a time
+        with model_lock:
+            return generate_cond(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                seconds_start=seconds_start,
+                seconds_total=seconds_total,
+                cfg_scale=cfg_scale,
+                steps=steps,
+                preview_every=preview_every,
+                seed=seed,
+                sampler_type=sampler_type,
+                sigma_min=sigma_min,
+                sigma_max=sigma_max,
+                cfg_rescale=cfg_rescale,
+                use_init=use_init,
+                init_audio=init_audio,
+                init_noise_level=init_noise_level,
+                mask_cropfrom=mask_cropfrom,
+                mask_pastefrom=mask_pastefrom,
+                mask_pasteto=mask_pasteto,
+                mask_maskstart=mask_maskstart,
+                mask_maskend=mask_maskend,
+                mask_softnessL=mask_softnessL,
+                mask_softnessR=mask_softnessR,
+                mask_marination=mask_marination,
+                batch_size=batch_size,
+                profile=profile,
+                early_exit_threshold=early_exit_threshold,
+                cfg_mode=cfg_mode,
+                is_cancelled=cancel_event.is_set,
+                deadline=deadline,
+            )
+
+
+@contextmanager
+def track_generation(request):
+    # Registers a cancel event for the browser session, so the Stop button
+    # or closing the page ends the generation at the next sampler step
+    cancel_event = threading.Event()
+    session = getattr(request, "session_hash", None)
+    with active_generations_lock:
+        active_generations.setdefault(session, set()).add(cancel_event)
+    try:
+        yield cancel_event
+    except GenerationCancelled as e:
+        raise gr.Error(f"Generation {e.reason.replace('_', ' ')}")
+    finally:
+        with active_generations_lock:
+            events = active_generations.get(session, set())
+            events.discard(cancel_event)
+            if not events:
+                active_generations.pop(session, None)
+
+
+def cancel_generation(request: gr.Request):
+    with active_generations_lock:
+        events = list(active_generations.get(request.session_hash, []))
+    for cancel_event in events:
+        cancel_event.set()
+
+
+def generate_cond_pool(pool, init_audio=None, batch_size=1, cancel_event=None, **job):
+    from aeiou.viz import audio_spectrogram_image
+
+    negative_prompt = job.pop("negative_prompt")
+    (sr, data), generation_info = pool.generate(
+        cancel_event=cancel_event,
+        prompts=[job.pop("prompt")] * batch_size,
+        negative_prompts=[negative_prompt] * batch_size if negative_prompt else None,
         init_audio=init_audio,
-        init_noise_level=init_noise_level,
-        mask_cropfrom=mask_cropfrom,
-        mask_pastefrom=mask_pastefrom,
-        mask_pasteto=mask_pasteto,
-        mask_maskstart=mask_maskstart,
-        mask_maskend=mask_maskend,
-        mask_softnessL=mask_softnessL,
-        mask_softnessR=mask_softnessR,
-        mask_marination=mask_marination,
-        batch_size=batch_size,
+        **job,
+    )
+    audio_spectrogram = audio_spectrogram_image(
+        torch.from_numpy(data.T), sample_rate=sr
     )
+    return ((sr, data), [audio_spectrogram], generation_info)
 
 
 def get_local_dir(name):
@@ -323,26 +593,45 @@ def load_model_config(model_name):
         raise Exception(message)
 
 
-def unload_model():
-    from stable_audio_tools.interface.gradio import model, model_type
-
-    del model, model_type
-    torch.cuda.empty_cache()
+def load_model_by_name(
+    model_name,
+    model_half=False,
+    device=None,
+    pretransform_ckpt_path=None,
+    mmap_weights=False,
+    precision="fp32",
+    compile_mode="none",
+    warmup=False,
+    offload="none",
+    parallel_load=False,
+):
+    global sample_rate, sample_size, precision_mode, warmup_report, loaded_model_name
+    global offload_report, load_report, load_options
 
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-def stable_audio_ui():
-    default_model_config_path = os.path.join(LOCAL_DIR_BASE, "diffusion_cond.json")
-    with open(default_model_config_path) as f:
-        model_config = json.load(f)
+    if model_half and precision != "fp32":
+        # Quantising or autocasting fp16 weights is not the mode being asked for
+        raise Exception(f"{precision} needs fp32 weights, turn off half precision")
 
-    pretransform_ckpt_path = None
-    pretrained_name = None
+    if offload != "none":
+        if precision == "int8 dynamic":
+            raise Exception("Offloading does not support int8 dynamic precision")
+        if compile_mode == "TorchScript decoder":
+            raise Exception("Offloading does not support the TorchScript decoder")
 
-    def load_model_helper(model_name, model_half):
-        if model_name == None:
-            return model_name
+    # With offloading the components only reach the device one at a time
+    load_device = torch.device("cpu") if offload != "none" else device
 
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    load_report = None
+    if parallel_load:
+        model_config_new = load_model_parallel(
+            model_name, model_half, load_device, pretransform_ckpt_path, mmap_weights
+        )
+    elif mmap_weights:
+        model_config_new = load_model_mmap(model_name, model_half, load_device)
+    else:
         from stable_audio_tools.interface.gradio import load_model
 
         _, model_config_new = load_model(
@@ -351,14 +640,135 @@ def stable_audio_ui():
             pretrained_name=None,
             pretransform_ckpt_path=pretransform_ckpt_path,
             model_half=model_half,
-            device=device,  # type: ignore
+            device=load_device,  # type: ignore
+        )
+
+    model_type = model_config_new["model_type"]  # type: ignore
+
+    if model_type != "diffusion_cond":
+        gr.Error("Only diffusion_cond models are supported")
+        raise Exception("Only diffusion_cond models are supported")
+
+    from stable_audio_tools.interface.gradio import model
+
+    apply_precision(model, precision)
+    precision_mode = precision
+    loaded_model_name = model_name
+
+    sample_rate = model_config_new["sample_rate"]  # type: ignore
+    sample_size = model_config_new["sample_size"]  # type: ignore
+
+    compile_model(model, model_name, compile_mode)
+    offload_report = apply_offload(model, model_name, offload, device)
+    load_options = {
+        "model_name": model_name,
+        "model_half": model_half,
+        "device": device,
+        "pretransform_ckpt_path": pretransform_ckpt_path,
+        "mmap_weights": mmap_weights,
+        "precision": precision,
+        "compile_mode": compile_mode,
+        "offload": offload,
+        "parallel_load": parallel_load,
+    }
+    warmup_report = warm_up() if warmup else None
+
+    return model_config_new
+
+
+def load_model_mmap(model_name, model_half, device):
+    # Weights stay backed by the checkpoint file on CPU, so worker processes
+    # share one copy through the page cache. Half precision or a GPU device
+    # copies them out of the mapping.
+    import stable_audio_tools.interface.gradio as stable_audio_gradio
+    from stable_audio_tools.models.factory import create_model_from_config
+
+    from .weights import load_state_dict_mmap, assign_state_dict
+
+    model_config = load_model_config(model_name)
+
+    print(f"Creating model from config")
+    model = create_model_from_config(model_config)
+
+    ckpt_path = get_ckpt_path(model_name)
+    print(f"Memory-mapping model checkpoint from {ckpt_path}")
+    assign_state_dict(model, load_state_dict_mmap(ckpt_path))
+
+    model.to(device).eval().requires_grad_(False)
+
+    if model_half:
+        model.to(torch.float16)
+
+    stable_audio_gradio.model = model
+    stable_audio_gradio.sample_rate = model_config["sample_rate"]
+    stable_audio_gradio.sample_size = model_config["sample_size"]
+
+    print(f"Done loading model")
+
+    return model_config
+
+
+def load_model_parallel(
+    model_name, model_half, device, pretransform_ckpt_path, mmap_weights
+):
+    global load_report
+
+    import stable_audio_tools.interface.gradio as stable_audio_gradio
+
+    from .parallel_load import load_model_parallel as load_components
+    from .weights import load_state_dict_mmap
+
+    model_config = load_model_config(model_name)
+    model, load_report = load_components(
+        model_config, get_ckpt_path(model_name), model_half, device, mmap_weights
+    )
+
+    if pretransform_ckpt_path is not None:
+        print(f"Loading pretransform checkpoint from {pretransform_ckpt_path}")
+        model.pretransform.load_state_dict(
+            load_state_dict_mmap(pretransform_ckpt_path), strict=False
         )
 
-        model_type = model_config_new["model_type"]  # type: ignore
+    stable_audio_gradio.model = model
+    stable_audio_gradio.sample_rate = model_config["sample_rate"]
+    stable_audio_gradio.sample_size = model_config["sample_size"]
+
+    return model_config
 
-        if model_type != "diffusion_cond":
-            gr.Error("Only diffusion_cond models are supported")
-            raise Exception("Only diffusion_cond models are supported")
+
+def unload_model():
+    from stable_audio_tools.interface.gradio import model, model_type
+
+    del model, model_type
+    torch.cuda.empty_cache()
+
+
+def stable_audio_ui():
+    default_model_config_path = os.path.join(LOCAL_DIR_BASE, "diffusion_cond.json")
+    with open(default_model_config_path) as f:
+        model_config = json.load(f)
+
+    pretransform_ckpt_path = None
+    pretrained_name = None
+
+    def load_model_helper(
+        model_name, model_half, precision, compile_mode, warmup, offload, parallel
+    ):
+        if model_name == None:
+            return model_name, ""
+
+        # Not while a generation is running on the current model
+        with model_lock:
+            load_model_by_name(
+                model_name,
+                model_half=model_half,
+                pretransform_ckpt_path=pretransform_ckpt_path,
+                precision=precision,
+                compile_mode=compile_mode,
+                warmup=warmup,
+                offload=offload,
+                parallel_load=parallel,
+            )
 
         # if model_type == "diffusion_cond":
         #     ui = create_txt2audio_ui(model_config)
@@ -371,7 +781,26 @@ def stable_audio_ui():
         # elif model_type == "lm":
         #     ui = create_lm_ui(model_config)
 
-        return model_name
+        status = f"Loaded {model_name}"
+        if load_report is not None:
+            component_times = ", ".join(
+                f"{name} {load_report[name]['total_seconds']}s"
+                for name in ["conditioner", "diffusion", "pretransform"]
+            )
+            status += f" in {load_report['total_seconds']}s ({component_times})"
+        if warmup_report is not None:
+            status += (
+                f", first request {warmup_report['cold_seconds']}s"
+                f" cold, {warmup_report['warm_seconds']}s warm"
+            )
+        if offload_report is not None:
+            status += (
+                f", {offload_report['offloaded_mb']} MB of weights resident"
+                f" instead of {offload_report['all_resident_mb']} MB"
+                f" ({offload_report['saved_mb']} MB saved, estimated from"
+                " weight sizes, the measured peak is in each output JSON)"
+            )
+        return model_name, status
 
     def model_select_ui():
         with gr.Row():
@@ -412,16 +841,52 @@ def stable_audio_ui():
                     label="Use half precision when loading the model",
                     value=True,
                 )
+                precision_dropdown = gr.Dropdown(
+                    PRECISION_MODES,
+                    label="Precision mode (for CPU, needs half precision off)",
+                    value="fp32",
+                )
+                with gr.Row():
+                    compile_dropdown = gr.Dropdown(
+                        COMPILE_MODES,
+                        label="Compile (cached in the model folder)",
+                        value="none",
+                    )
+                    warmup_checkbox = gr.Checkbox(
+                        label="Warm up after loading",
+                        value=False,
+                    )
+                    parallel_checkbox = gr.Checkbox(
+                        label="Load components in parallel",
+                        value=False,
+                    )
+                offload_dropdown = gr.Dropdown(
+                    OFFLOAD_MODES,
+                    label="Offload components (keeps only the running stage on the device, the others in CPU memory or memory-mapped files)",
+                    value="none",
+                )
+                load_status = gr.Markdown()
 
             load_model_button.click(
                 fn=load_model_helper,
-                inputs=[model_select, half_checkbox],
-                outputs=[model_select],
+                inputs=[
+                    model_select,
+                    half_checkbox,
+                    precision_dropdown,
+                    compile_dropdown,
+                    warmup_checkbox,
+                    offload_dropdown,
+                    parallel_checkbox,
+                ],
+                outputs=[model_select, load_status],
             )
 
-            
+        return model_select, precision_dropdown
 
-    model_select_ui()
+    model_select, precision_dropdown = model_select_ui()
+    worker_pool_ui(model_select, precision_dropdown)
+    precision_check_ui(model_select, precision_dropdown)
+    http_api_ui()
 
     with gr.Tabs():
         with gr.Tab("Generation"):
@@ -435,9 +900,334 @@ def stable_audio_ui():
             create_sampling_ui(model_config, inpainting=True)
             open_dir_btn = gr.Button("Open outputs folder")
             open_dir_btn.click(lambda: open_folder(OUTPUT_DIR))
+        with gr.Tab("Long-form"):
+            longform_ui()
+        with gr.Tab("History"):
+            history_ui()
         with gr.Tab("Model Download"):
             model_download_ui()
 
+    # Closing the page cancels whatever the session is still generating
+    from gradio.context import Context
+
+    root_block = Context.root_block
+    if root_block is not None and hasattr(root_block, "unload"):
+        root_block.unload(cancel_generation)
+
+
+def worker_pool_ui(model_select, precision_dropdown):
+    from . import worker_pool
+
+    with gr.Accordion("CPU worker pool", open=False):
+        gr.Markdown(
+            """
+            Runs generations in separate processes, each pinned to its own set of CPU cores.
+            The checkpoint weights are memory-mapped and shared between the workers, the T5 encoder is loaded by each worker.
+            Previews and inpainting are not available while the pool is running.
+            While the pool is running, generations go to the pool instead of the loaded model.
+            """
+        )
+        with gr.Row():
+            workers_slider = gr.Slider(
+                minimum=1,
+                maximum=len(worker_pool.get_available_cores()),
+                step=1,
+                value=1,
+                label="Workers",
+            )
+            threads_number = gr.Number(
+                value=0,
+                precision=0,
+                label="Threads per worker (0 = one per pinned core)",
+            )
+        with gr.Row():
+            start_pool_button = gr.Button("Start worker pool")
+            stop_pool_button = gr.Button("Stop worker pool")
+        pool_status = gr.Markdown()
+
+    start_pool_button.click(
+        fn=worker_pool.start_pool,
+        inputs=[model_select, workers_slider, threads_number, precision_dropdown],
+        outputs=[pool_status],
+        api_name="stable_audio_start_worker_pool",
+    )
+    stop_pool_button.click(
+        fn=worker_pool.stop_pool,
+        outputs=[pool_status],
+        api_name="stable_audio_stop_worker_pool",
+    )
+
+
+def precision_check_ui(model_select, precision_dropdown):
+    with gr.Accordion("Precision check", open=False):
+        gr.Markdown(
+            """
+            Generates the same prompt and seed in fp32 and in the selected precision mode and compares latency and output.
+            Both runs load fp32 weights (half precision off). The other load options (compile, offload, parallel loading) are taken from the loaded model, which is reloaded once the check is done.
+            Results are appended to `precision_check.json` in the model folder.
+            """
+        )
+        with gr.Row():
+            check_prompt = gr.Textbox(
+                label="Prompt", value="Rain falling on a tin roof"
+            )
+            check_steps = gr.Slider(
+                minimum=1, maximum=250, step=1, value=50, label="Steps"
+            )
+            check_seconds = gr.Slider(
+                minimum=1, maximum=47, step=1, value=10, label="Seconds total"
+            )
+        check_button = gr.Button("Run precision check")
+        check_report = gr.JSON(label="Report")
+
+    check_button.click(
+        fn=run_precision_check,
+        inputs=[
+            model_select,
+            precision_dropdown,
+            check_prompt,
+            check_steps,
+            check_seconds,
+        ],
+        outputs=[check_report],
+        api_name="stable_audio_precision_check",
+    )
+
+
+def history_ui():
+    gr.Markdown(
+        "Search saved generations. Results saved before the index existed are added with \"Index existing outputs\"."
+    )
+    with gr.Row():
+        prompt_filter = gr.Textbox(label="Prompt words")
+        model_filter = gr.Dropdown(
+            choices=["", *get_model_list()],
+            value="",
+            label="Model",
+            allow_custom_value=True,
+        )
+        date_from = gr.Textbox(label="From date", placeholder="2024-01-01")
+        date_to = gr.Textbox(label="To date", placeholder="2024-12-31")
+    with gr.Row():
+        search_button = gr.Button("Search", variant="primary")
+        duplicates_button = gr.Button("Find duplicate parameter sets")
+        backfill_button = gr.Button("Index existing outputs")
+    history_status = gr.Markdown()
+    history_table = gr.Dataframe(interactive=False, wrap=True)
+
+    def search_history(prompt, model, date_from, date_to):
+        return gr.Dataframe(
+            value=history.search(prompt, model, date_from, date_to),
+            headers=["Date", "Prompt", "Model", "Seed", "Duration", "Path"],
+        )
+
+    def find_duplicates():
+        return gr.Dataframe(
+            value=history.find_duplicates(),
+            headers=["Prompt", "Model", "Seed", "Copies", "Paths"],
+        )
+
+    search_button.click(
+        fn=search_history,
+        inputs=[prompt_filter, model_filter, date_from, date_to],
+        outputs=[history_table],
+        api_name="stable_audio_history_search",
+    )
+    duplicates_button.click(
+        fn=find_duplicates,
+        outputs=[history_table],
+        api_name="stable_audio_history_duplicates",
+    )
+    backfill_button.click(
+        fn=lambda: f"Indexed {history.backfill()} existing results",
+        outputs=[history_status],
+        api_name="stable_audio_history_backfill",
+    )
+
+
+def http_api_ui():
+    with gr.Accordion("HTTP API", open=False):
+        gr.Markdown(
+            """
+            Serves the loaded model over a small HTTP API that returns WAV or raw PCM bytes.
+            `POST /generate` returns the audio directly, `POST /jobs` queues a generation to poll with `GET /jobs/{job_id}`
+            and fetch with `GET /jobs/{job_id}/audio`. The request schema is listed at `/docs`.
+            """
+        )
+        with gr.Row():
+            api_host = gr.Textbox(label="Host", value="127.0.0.1")
+            api_port = gr.Number(label="Port", value=7871, precision=0)
+            api_concurrency = gr.Number(
+                label="Concurrent generations (0 = worker pool size, or 4)",
+                value=0,
+                precision=0,
+            )
+        with gr.Row():
+            start_api_button = gr.Button("Start HTTP API")
+            stop_api_button = gr.Button("Stop HTTP API")
+        api_status = gr.Markdown()
+
+    def start_api(host, port, max_concurrent):
+        from .http_api import start_server
+
+        try:
+            return start_server(host, port, max_concurrent)
+        except Exception as e:
+            raise gr.Error(str(e))
+
+    def stop_api():
+        from .http_api import stop_server
+
+        return stop_server()
+
+    start_api_button.click(
+        fn=start_api,
+        inputs=[api_host, api_port, api_concurrency],
+        outputs=[api_status],
+    )
+    stop_api_button.click(
+        fn=stop_api,
+        outputs=[api_status],
+    )
+
+
+def longform_ui():
+    gr.Markdown(
+        """
+        Generates audio longer than the model window by continuing each window from the end of the previous one.
+        The windows are crossfaded over the overlap and written to the outputs folder as they finish.
+        Note: continuation uses init audio, which fails with half precision models.
+        """
+    )
+    with gr.Row():
+        with gr.Column(scale=6):
+            text = gr.Textbox(show_label=False, placeholder="Prompt")
+            negative_prompt = gr.Textbox(
+                show_label=False, placeholder="Negative prompt"
+            )
+        with gr.Column(scale=1):
+            generate_button = gr.Button("Generate", variant="primary")
+            stop_button = gr.Button("Stop")
+
+    with gr.Row(equal_height=False):
+        with gr.Column():
+            with gr.Row():
+                duration_slider = gr.Slider(
+                    minimum=10, maximum=1800, step=1, value=180, label="Duration (s)"
+                )
+                overlap_slider = gr.Slider(
+                    minimum=1, maximum=20, step=0.5, value=10, label="Overlap (s)"
+                )
+            with gr.Row():
+                profile_dropdown = gr.Dropdown(
+                    PROFILE_CHOICES, label="Steps profile", value="Custom"
+                )
+                steps_slider = gr.Slider(
+                    minimum=1, maximum=500, step=1, value=100, label="Steps"
+                )
+                cfg_scale_slider = gr.Slider(
+                    minimum=0.0, maximum=25.0, step=0.1, value=7.0, label="CFG scale"
+                )
+            with gr.Accordion("Sampler params", open=False):
+                seed_textbox = gr.Textbox(label="Seed", value="-1")
+                with gr.Row():
+                    sampler_type_dropdown = gr.Dropdown(
+                        SAMPLER_TYPES,
+                        label="Sampler type",
+                        value="dpmpp-3m-sde",
+                    )
+                    sigma_min_slider = gr.Slider(
+                        minimum=0.0,
+                        maximum=2.0,
+                        step=0.01,
+                        value=0.03,
+                        label="Sigma min",
+                    )
+                    sigma_max_slider = gr.Slider(
+                        minimum=0.0,
+                        maximum=1000.0,
+                        step=0.1,
+                        value=500,
+                        label="Sigma max",
+                    )
+                    cfg_rescale_slider = gr.Slider(
+                        minimum=0.0,
+                        maximum=1,
+                        step=0.01,
+                        value=0.0,
+                        label="CFG rescale amount",
+                    )
+                cfg_mode_dropdown = gr.Dropdown(
+                    CFG_MODES, label="CFG execution", value="Auto"
+                )
+
+        with gr.Column():
+            audio_output = gr.Audio(label="Output audio", interactive=False)
+
+    def generate_longform_lazy(
+        prompt,
+        negative_prompt,
+        duration,
+        overlap,
+        cfg_scale,
+        steps,
+        seed,
+        sampler_type,
+        sigma_min,
+        sigma_max,
+        cfg_rescale,
+        profile,
+        cfg_mode,
+        request: gr.Request,
+    ):
+        from stable_audio_tools.interface.gradio import model
+
+        from .longform import generate_longform
+
+        if model is None:
+            gr.Error("Model not loaded")
+            raise Exception("Model not loaded")
+
+        with track_generation(request) as cancel_event, model_lock:
+            return generate_longform(
+                prompt,
+                negative_prompt,
+                duration,
+                overlap,
+                cfg_scale,
+                steps,
+                seed,
+                sampler_type,
+                sigma_min,
+                sigma_max,
+                cfg_rescale,
+                profile,
+                cfg_mode,
+                is_cancelled=cancel_event.is_set,
+            )
+
+    generate_button.click(
+        fn=generate_longform_lazy,
+        inputs=[
+            text,
+            negative_prompt,
+            duration_slider,
+            overlap_slider,
+            cfg_scale_slider,
+            steps_slider,
+            seed_textbox,
+            sampler_type_dropdown,
+            sigma_min_slider,
+            sigma_max_slider,
+            cfg_rescale_slider,
+            profile_dropdown,
+            cfg_mode_dropdown,
+        ],
+        outputs=[audio_output],
+        api_name="stable_audio_generate_longform",
+    )
+    stop_button.click(fn=cancel_generation, queue=False)
+
 
 def model_download_ui():
     gr.Markdown(
@@ -483,7 +1273,11 @@ import scipy.io.wavfile as wavfile
 from tts_webui.utils.date import get_date_string
 
 
-def save_result(audio, *generation_args):
+def save_result(audio, generation_info, *generation_args):
+    write_result(audio, *generation_args, extra_metadata=generation_info)
+
+
+def write_result(audio, *generation_args, name_suffix="", extra_metadata=None):
     date = get_date_string()
 
     generation_args = {
@@ -503,11 +1297,14 @@ def save_result(audio, *generation_args):
         "init_audio_checkbox": generation_args[12],
         "init_audio_input": generation_args[13],
         "init_noise_level_slider": generation_args[14],
+        "model": loaded_model_name,
     }
+    if extra_metadata:
+        generation_args.update(extra_metadata)
     print(generation_args)
     prompt = generation_args["prompt"]
 
-    name = f"{date}_{prompt_to_title(prompt)}"
+    name = f"{date}_{prompt_to_title(prompt)}{name_suffix}"
 
     base_dir = os.path.join(OUTPUT_DIR, name)
     os.makedirs(base_dir, exist_ok=True)
@@ -524,6 +1321,13 @@ def save_result(audio, *generation_args):
             default=lambda o: "<not serializable>",
         )
 
+    try:
+        history.add_result(os.path.join(base_dir, f"{name}.wav"), generation_args)
+    except Exception as e:
+        print(f"Failed to index {name} in the history: {e}")
+
+    return base_dir
+
 
 def create_uncond_sampling_ui():
     generate_button = gr.Button("Generate", variant="primary", scale=1)
@@ -545,15 +1349,7 @@ def create_uncond_sampling_ui():
                 # Sampler params
                 with gr.Row():
                     sampler_type_dropdown = gr.Dropdown(
-                        [
-                            "dpmpp-2m-sde",
-                            "dpmpp-3m-sde",
-                            "k-heun",
-                            "k-lms",
-                            "k-dpmpp-2s-ancestral",
-                            "k-dpm-2",
-                            "k-dpm-fast",
-                        ],
+                        SAMPLER_TYPES,
                         label="Sampler type",
                         value="dpmpp-3m-sde",
                     )
@@ -625,7 +1421,9 @@ def create_sampling_ui(model_config, inpainting=False):
             negative_prompt = gr.Textbox(
                 show_label=False, placeholder="Negative prompt"
             )
-        generate_button = gr.Button("Generate", variant="primary", scale=1)
+        with gr.Column(scale=1):
+            generate_button = gr.Button("Generate", variant="primary")
+            stop_button = gr.Button("Stop")
 
     model_conditioning_config = model_config["model"].get("conditioning", None)
 
@@ -661,6 +1459,13 @@ def create_sampling_ui(model_config, inpainting=False):
                 )
 
             with gr.Row():
+                # Steps profile, Custom uses the steps slider
+                profile_dropdown = gr.Dropdown(
+                    PROFILE_CHOICES,
+                    label="Steps profile",
+                    value="Custom",
+                )
+
                 # Steps slider
                 steps_slider = gr.Slider(
                     minimum=1, maximum=500, step=1, value=100, label="Steps"
@@ -687,15 +1492,7 @@ def create_sampling_ui(model_config, inpainting=False):
                 # Sampler params
                 with gr.Row():
                     sampler_type_dropdown = gr.Dropdown(
-                        [
-                            "dpmpp-2m-sde",
-                            "dpmpp-3m-sde",
-                            "k-heun",
-                            "k-lms",
-                            "k-dpmpp-2s-ancestral",
-                            "k-dpm-2",
-                            "k-dpm-fast",
-                        ],
+                        SAMPLER_TYPES,
                         label="Sampler type",
                         value="dpmpp-3m-sde",
                     )
@@ -721,6 +1518,28 @@ def create_sampling_ui(model_config, inpainting=False):
                         label="CFG rescale amount",
                     )
 
+                cfg_mode_dropdown = gr.Dropdown(
+                    CFG_MODES,
+                    label="CFG execution (Sequential uses less memory, Auto skips the negative prompt at CFG scale 1)",
+                    value="Auto",
+                )
+
+                early_exit_slider = gr.Slider(
+                    minimum=0.0,
+                    maximum=0.05,
+                    step=0.0005,
+                    value=0.0,
+                    label="Early exit threshold (stop when the denoised latents change less than this between steps, 0 = off)",
+                )
+
+                deadline_slider = gr.Slider(
+                    minimum=0,
+                    maximum=3600,
+                    step=1,
+                    value=0,
+                    label="Deadline in seconds (cancel the generation if it has not finished by then, 0 = none)",
+                )
+
             if inpainting:
                 # Inpainting Tab
                 with gr.Accordion("Inpainting", open=False):
@@ -812,6 +1631,10 @@ def create_sampling_ui(model_config, inpainting=False):
                         init_audio_checkbox,
                         init_audio_input,
                         init_noise_level_slider,
+                        profile_dropdown,
+                        early_exit_slider,
+                        cfg_mode_dropdown,
+                        deadline_slider,
                         mask_cropfrom_slider,
                         mask_pastefrom_slider,
                         mask_pasteto_slider,
@@ -850,6 +1673,10 @@ def create_sampling_ui(model_config, inpainting=False):
                         init_audio_checkbox,
                         init_audio_input,
                         init_noise_level_slider,
+                        profile_dropdown,
+                        early_exit_slider,
+                        cfg_mode_dropdown,
+                        deadline_slider,
                     ]
 
         with gr.Column():
@@ -863,6 +1690,7 @@ def create_sampling_ui(model_config, inpainting=False):
                 inputs=[audio_output],
                 outputs=[init_audio_input],
             )
+            generation_info = gr.State({})
 
     def randomize_seed(seed, randomize_seed):
         if randomize_seed:
@@ -877,12 +1705,14 @@ def create_sampling_ui(model_config, inpainting=False):
     ).then(
         fn=generate_cond_lazy,
         inputs=inputs,
-        outputs=[audio_output, audio_spectrogram_output],
+        outputs=[audio_output, audio_spectrogram_output, generation_info],
         api_name="stable_audio_inpaint" if inpainting else "stable_audio_generate",
-    ).then(
+        concurrency_limit=None,
+    ).success(
         fn=save_result,
         inputs=[
             audio_output,
+            generation_info,
             *inputs,
         ],
         api_name="stable_audio_save_inpaint" if inpainting else "stable_audio_save",
@@ -890,6 +1720,8 @@ def create_sampling_ui(model_config, inpainting=False):
         fn=torch_clear_memory,
     )
 
+    stop_button.click(fn=cancel_generation, queue=False)
+
 
 # FEATURE - crop the audio to the actual length specified
 # def crop_audio(audio, seconds_start_slider, seconds_total_slider):
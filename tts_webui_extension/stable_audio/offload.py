@@ -0,0 +1,269 @@
+# Staged component offloading
+#
+# A generation uses one component at a time: the conditioners (T5) embed the
+# prompt, the DiT samples and the pretransform decodes. With offloading only
+# the running component is on the generation device. The others stay in
+# pinned CPU memory ("CPU") or in memory-mapped files in the model folder
+# ("Disk (mmap)"), where idle weights are clean page cache the kernel can
+# drop. While one stage runs, the next one is fetched in the background: on
+# "CPU" it is copied to the GPU on a side CUDA stream, on "Disk (mmap)" its
+# file is read ahead into the page cache by a thread.
+import os
+import threading
+
+import torch
+
+OFFLOAD_MODES = ["none", "CPU", "Disk (mmap)"]
+
+# Order the stages run in, the one after the last is the next request's
+STAGES = ["conditioner", "diffusion", "pretransform"]
+
+PREFETCH_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def get_offload_cache_dir(model_name):
+    from .main import get_local_dir
+
+    cache_dir = os.path.join(get_local_dir(model_name), "offload_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_stage_modules(model, stage):
+    if stage == "conditioner":
+        modules = [model.conditioner]
+        # Frozen encoders like T5 are kept out of the module tree so they are
+        # not saved with the checkpoint, and are not moved by model.to()
+        for conditioner in model.conditioner.conditioners.values():
+            hidden = vars(conditioner).get("model")
+            if isinstance(hidden, torch.nn.Module):
+                modules.append(hidden)
+        return modules
+    if stage == "diffusion":
+        return [model.model]
+    return [model.pretransform] if model.pretransform is not None else []
+
+
+def get_stage_entries(modules):
+    # Where each parameter and buffer lives, shared parameters only once
+    seen = set()
+    entries = []
+    for module in modules:
+        for owner in module.modules():
+            for kind in ["_parameters", "_buffers"]:
+                for name, tensor in getattr(owner, kind).items():
+                    if tensor is None or id(tensor) in seen:
+                        continue
+                    seen.add(id(tensor))
+                    entries.append((owner, kind, name))
+    return entries
+
+
+def get_tensor(entry):
+    owner, kind, name = entry
+    return getattr(owner, kind)[name]
+
+
+def set_tensor(entry, tensor):
+    owner, kind, name = entry
+    if kind == "_parameters":
+        owner._parameters[name].data = tensor
+    else:
+        owner._buffers[name] = tensor
+
+
+def load_or_write_stage(path, tensors):
+    from safetensors.torch import save_file
+
+    from .weights import load_safetensors_mmap
+
+    if os.path.exists(path):
+        home = load_safetensors_mmap(path)
+        if len(home) == len(tensors) and all(
+            home[str(i)].shape == tensor.shape for i, tensor in enumerate(tensors)
+        ):
+            return [home[str(i)] for i in range(len(tensors))]
+
+    print(f"Writing offloaded weights to {path}")
+    save_file(
+        {
+            str(i): tensor.detach().cpu().contiguous()
+            for i, tensor in enumerate(tensors)
+        },
+        f"{path}.tmp",
+    )
+    os.replace(f"{path}.tmp", path)
+    home = load_safetensors_mmap(path)
+    return [home[str(i)] for i in range(len(tensors))]
+
+
+def read_ahead(path):
+    # Reading the file pulls it into the page cache, the mapped tensors then
+    # fault in from memory instead of from disk
+    with open(path, "rb", buffering=0) as f:
+        while f.read(PREFETCH_CHUNK_SIZE):
+            pass
+
+
+class StagedOffload:
+    def __init__(self, model, mode, device, cache_dir=None, cache_key=""):
+        self.mode = mode
+        self.device = device
+        self.active = None
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.paths = {}
+        # Next stage copied ahead on the GPU, with the event that marks it ready
+        self.prefetched = {}
+        self.copy_stream = None
+        if mode == "CPU":
+            self.copy_stream = torch.cuda.Stream(device)
+
+        for stage in STAGES:
+            entries = get_stage_entries(get_stage_modules(model, stage))
+            tensors = [get_tensor(entry) for entry in entries]
+            if mode == "CPU":
+                home = [tensor.detach().cpu().pin_memory() for tensor in tensors]
+            else:
+                path = os.path.join(cache_dir, f"{stage}_{cache_key}.safetensors")
+                home = load_or_write_stage(path, tensors)
+                self.paths[stage] = path
+            for entry, tensor in zip(entries, home):
+                set_tensor(entry, tensor)
+            self.stages[stage] = (entries, home)
+
+        model.conditioner.register_forward_pre_hook(
+            lambda module, args: self.activate("conditioner")
+        )
+        model.model.register_forward_pre_hook(
+            lambda module, args: self.activate("diffusion")
+        )
+        if model.pretransform is not None:
+            # encode/decode are plain methods, so they get wrapped instead
+            for method in ["encode", "decode"]:
+                setattr(
+                    model.pretransform,
+                    method,
+                    self.wrap(getattr(model.pretransform, method), "pretransform"),
+                )
+
+    def wrap(self, fn, stage):
+        def wrapper(*args, **kwargs):
+            self.activate(stage)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def activate(self, stage):
+        if stage == self.active:
+            return
+        with self.lock:
+            if self.active is not None:
+                # Weights are never written during inference, so dropping the
+                # device copy is enough to offload them
+                entries, home = self.stages[self.active]
+                for entry, tensor in zip(entries, home):
+                    set_tensor(entry, tensor)
+
+            # On CPU the mapped tensors are used in place
+            if self.device.type != "cpu":
+                entries, _ = self.stages[stage]
+                for entry, tensor in zip(entries, self.to_device(stage)):
+                    set_tensor(entry, tensor)
+            self.active = stage
+
+            self.prefetch(STAGES[(STAGES.index(stage) + 1) % len(STAGES)])
+
+    def to_device(self, stage):
+        _, home = self.stages[stage]
+        prefetched = self.prefetched.pop(stage, None)
+        if prefetched is None:
+            return [tensor.to(self.device, non_blocking=True) for tensor in home]
+
+        copies, ready = prefetched
+        stream = torch.cuda.current_stream(self.device)
+        stream.wait_event(ready)
+        for tensor in copies:
+            # Allocated on the copy stream, so the allocator has to know the
+            # compute stream uses it before the memory can be reused
+            tensor.record_stream(stream)
+        return copies
+
+    def prefetch(self, stage):
+        if self.copy_stream is not None:
+            if stage in self.prefetched:
+                return
+            # Pinned memory makes these copies asynchronous, they overlap
+            # with the running stage
+            _, home = self.stages[stage]
+            with torch.cuda.stream(self.copy_stream):
+                copies = [tensor.to(self.device, non_blocking=True) for tensor in home]
+                ready = torch.cuda.Event()
+                ready.record(self.copy_stream)
+            self.prefetched[stage] = (copies, ready)
+            return
+
+        if stage not in self.paths:
+            return
+        threading.Thread(
+            target=read_ahead, args=(self.paths[stage],), daemon=True
+        ).start()
+
+    def get_report(self):
+        stage_mb = {
+            stage: sum(tensor.numel() * tensor.element_size() for tensor in home)
+            / 2**20
+            for stage, (_, home) in self.stages.items()
+        }
+        # Weight sizes only, activations are not included. On "CPU" the next
+        # stage is already on the GPU while one runs.
+        all_resident_mb = sum(stage_mb.values())
+        if self.copy_stream is not None:
+            offloaded_mb = max(
+                stage_mb[stage] + stage_mb[STAGES[(i + 1) % len(STAGES)]]
+                for i, stage in enumerate(STAGES)
+            )
+        else:
+            offloaded_mb = max(stage_mb.values())
+        return {
+            "mode": self.mode,
+            "stage_mb": {stage: round(mb) for stage, mb in stage_mb.items()},
+            "all_resident_mb": round(all_resident_mb),
+            "offloaded_mb": round(offloaded_mb),
+            "saved_mb": round(all_resident_mb - offloaded_mb),
+        }
+
+
+def apply_offload(model, model_name, mode, device):
+    from .main import get_ckpt_path
+
+    if mode == "none":
+        return None
+    if mode == "CPU" and device.type == "cpu":
+        raise Exception("CPU offloading needs a CUDA device, use Disk (mmap) on CPU")
+
+    cache_dir = None
+    cache_key = ""
+    if mode == "Disk (mmap)":
+        cache_dir = get_offload_cache_dir(model_name)
+        dtype_name = str(next(model.model.parameters()).dtype).split(".")[-1]
+        ckpt_mtime = int(os.path.getmtime(get_ckpt_path(model_name)))
+        cache_key = f"{dtype_name}_{ckpt_mtime}"
+
+    model.staged_offload = StagedOffload(model, mode, device, cache_dir, cache_key)
+    if device.type != "cpu":
+        torch.cuda.empty_cache()
+
+    report = model.staged_offload.get_report()
+    print(
+        f"Offloading to {mode}: {report['offloaded_mb']} MB of weights resident"
+        f" at a time instead of {report['all_resident_mb']} MB"
+    )
+    return report
+
+
+def get_execution_device(model):
+    offload = getattr(model, "staged_offload", None)
+    if offload is not None:
+        return offload.device
+    return next(model.parameters()).device
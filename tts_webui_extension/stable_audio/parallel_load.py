@@ -0,0 +1,197 @@
+# Parallel model loading
+#
+# The conditioners (with the T5 tokenizer and encoder from the Hugging Face
+# cache), the DiT and the pretransform do not depend on each other, so each
+# one is built in its own thread while another thread reads its slice of the
+# checkpoint. The weights are then assigned to the finished module and moved
+# to the device, still in that component's thread. Module construction,
+# tensor copies and file reads release the GIL for most of their time.
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .weights import load_state_dict_mmap, assign_state_dict
+
+# Checkpoint key prefix of each component
+COMPONENT_PREFIXES = {
+    "conditioner": "conditioner.",
+    "diffusion": "model.",
+    "pretransform": "pretransform.",
+}
+
+
+def build_conditioner(model_config):
+    from stable_audio_tools.models.conditioners import (
+        create_multi_conditioner_from_conditioning_config,
+    )
+
+    conditioning_config = model_config["model"].get("conditioning", None)
+    if conditioning_config is None:
+        return None
+    return create_multi_conditioner_from_conditioning_config(conditioning_config)
+
+
+def build_diffusion(model_config):
+    from stable_audio_tools.models.diffusion import (
+        DiTWrapper,
+        UNetCFG1DWrapper,
+        UNet1DCondWrapper,
+    )
+
+    diffusion_config = model_config["model"]["diffusion"]
+    diffusion_model_type = diffusion_config["type"]
+    diffusion_model_config = diffusion_config["config"]
+
+    if diffusion_model_type == "adp_cfg_1d":
+        return UNetCFG1DWrapper(**diffusion_model_config)
+    if diffusion_model_type == "adp_1d":
+        return UNet1DCondWrapper(**diffusion_model_config)
+    if diffusion_model_type == "dit":
+        return DiTWrapper(**diffusion_model_config)
+    raise Exception(f"Unknown diffusion model type {diffusion_model_type}")
+
+
+def build_pretransform(model_config):
+    from stable_audio_tools.models.factory import create_pretransform_from_config
+
+    pretransform_config = model_config["model"].get("pretransform", None)
+    if pretransform_config is None:
+        return None
+    return create_pretransform_from_config(
+        pretransform_config, model_config["sample_rate"]
+    )
+
+
+COMPONENT_BUILDERS = {
+    "conditioner": build_conditioner,
+    "diffusion": build_diffusion,
+    "pretransform": build_pretransform,
+}
+
+
+def read_component(state_dict, prefix, model_half, mmap_weights):
+    start = time.perf_counter()
+    weights = {}
+    for key, value in state_dict.items():
+        if not key.startswith(prefix):
+            continue
+        if model_half and value.is_floating_point():
+            value = value.to(torch.float16)
+        elif not mmap_weights:
+            # Copying out of the mapping is what actually reads the file
+            value = value.clone()
+        weights[key[len(prefix) :]] = value
+    return weights, time.perf_counter() - start
+
+
+def load_component(
+    name, model_config, state_dict, model_half, mmap_weights, device, executor
+):
+    start = time.perf_counter()
+    read = executor.submit(
+        read_component,
+        state_dict,
+        COMPONENT_PREFIXES[name],
+        model_half,
+        mmap_weights,
+    )
+    module = COMPONENT_BUILDERS[name](model_config)
+    build_seconds = time.perf_counter() - start
+
+    weights, read_seconds = read.result()
+    fill_start = time.perf_counter()
+    if module is not None:
+        assign_state_dict(module, weights)
+        module.to(device).eval().requires_grad_(False)
+        if model_half:
+            module.to(torch.float16)
+    del weights
+
+    return module, {
+        "build_seconds": round(build_seconds, 3),
+        "read_seconds": round(read_seconds, 3),
+        "fill_seconds": round(time.perf_counter() - fill_start, 3),
+        "total_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def assemble_model(model_config, conditioner, diffusion_model, pretransform):
+    from stable_audio_tools.models.diffusion import ConditionedDiffusionModelWrapper
+
+    diffusion_config = model_config["model"]["diffusion"]
+
+    # Same wiring as stable_audio_tools create_diffusion_cond_from_config
+    min_input_length = 1
+    if pretransform is not None:
+        min_input_length = pretransform.downsampling_ratio
+    if diffusion_config["type"] in ["adp_cfg_1d", "adp_1d"]:
+        min_input_length *= np.prod(diffusion_config["config"]["factors"])
+    elif diffusion_config["type"] == "dit":
+        min_input_length *= diffusion_model.model.patch_size
+
+    return ConditionedDiffusionModelWrapper(
+        diffusion_model,
+        conditioner,
+        min_input_length=min_input_length,
+        sample_rate=model_config["sample_rate"],
+        cross_attn_cond_ids=diffusion_config.get("cross_attention_cond_ids", []),
+        global_cond_ids=diffusion_config.get("global_cond_ids", []),
+        input_concat_ids=diffusion_config.get("input_concat_ids", []),
+        prepend_cond_ids=diffusion_config.get("prepend_cond_ids", []),
+        pretransform=pretransform,
+        io_channels=model_config["model"]["io_channels"],
+        diffusion_objective=diffusion_config.get("diffusion_objective", "v"),
+    )
+
+
+def load_model_parallel(model_config, ckpt_path, model_half, device, mmap_weights):
+    if model_config["model_type"] != "diffusion_cond":
+        raise Exception("Parallel loading only supports diffusion_cond models")
+
+    start = time.perf_counter()
+    # Only the header is parsed here, the tensor data is read per component
+    state_dict = load_state_dict_mmap(ckpt_path)
+
+    # Separate pools, so a read is never queued behind the component
+    # threads that wait for it
+    read_executor = ThreadPoolExecutor(max_workers=len(COMPONENT_BUILDERS))
+    with read_executor, ThreadPoolExecutor(
+        max_workers=len(COMPONENT_BUILDERS)
+    ) as executor:
+        futures = {
+            name: executor.submit(
+                load_component,
+                name,
+                model_config,
+                state_dict,
+                model_half,
+                mmap_weights,
+                device,
+                read_executor,
+            )
+            for name in COMPONENT_BUILDERS
+        }
+        components = {name: future.result() for name, future in futures.items()}
+    del state_dict
+
+    model = assemble_model(
+        model_config,
+        components["conditioner"][0],
+        components["diffusion"][0],
+        components["pretransform"][0],
+    )
+    model.eval().requires_grad_(False)
+
+    report = {name: timings for name, (_, timings) in components.items()}
+    report["total_seconds"] = round(time.perf_counter() - start, 3)
+    for name in COMPONENT_BUILDERS:
+        timings = report[name]
+        print(
+            f"Loaded {name} in {timings['total_seconds']}s (build"
+            f" {timings['build_seconds']}s, read {timings['read_seconds']}s,"
+            f" fill {timings['fill_seconds']}s)"
+        )
+    print(f"Model ready in {report['total_seconds']}s")
+    return model, report
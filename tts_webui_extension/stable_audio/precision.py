@@ -0,0 +1,161 @@
+# Reduced precision inference for CPU nodes
+#
+# "bf16 autocast" keeps fp32 weights and runs the DiT and the pretransform
+# under bfloat16 autocast, "int8 dynamic" replaces their linear layers with
+# dynamically quantised int8 ones. The precision check measures both against
+# fp32 and keeps a per-model log of the results.
+import os
+import json
+import time
+import contextlib
+
+import torch
+
+from .offload import get_execution_device
+
+PRECISION_MODES = ["fp32", "bf16 autocast", "int8 dynamic"]
+
+PRECISION_CHECK_SEED = 1234
+
+
+def apply_precision(model, precision):
+    if precision != "int8 dynamic":
+        return
+
+    device = next(model.parameters()).device
+    if device.type != "cpu":
+        raise Exception("int8 dynamic quantisation is only supported on CPU")
+
+    # Only nn.Linear has a dynamic int8 kernel, in the Oobleck pretransform
+    # that leaves most of the convolutions in fp32. In place, so the
+    # remaining weights stay the memory-mapped ones shared between workers
+    torch.ao.quantization.quantize_dynamic(
+        model.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    if model.pretransform is not None:
+        torch.ao.quantization.quantize_dynamic(
+            model.pretransform, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+
+def precision_autocast(precision, device):
+    if precision == "bf16 autocast":
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def spectral_distance(reference, test):
+    def magnitude(audio):
+        audio = audio.float().reshape(-1, audio.shape[-1])
+        return torch.stft(
+            audio,
+            n_fft=2048,
+            hop_length=512,
+            window=torch.hann_window(2048),
+            return_complex=True,
+        ).abs()
+
+    reference_mag = magnitude(reference)
+    test_mag = magnitude(test)
+    return (
+        (torch.log1p(reference_mag) - torch.log1p(test_mag)).abs().mean()
+        / torch.log1p(reference_mag).abs().mean().clamp(min=1e-8)
+    ).item()
+
+
+def snr_db(reference, test):
+    reference = reference.float()
+    noise = (reference - test.float()).pow(2).sum().clamp(min=1e-12)
+    return (10 * torch.log10(reference.pow(2).sum() / noise)).item()
+
+
+def timed_generation(prompt, steps, seconds_total):
+    from . import main
+
+    # Short warm-up so one-off allocations are not counted against the mode
+    main.generate_cond_batch(
+        prompts=[prompt],
+        seconds_total=seconds_total,
+        steps=2,
+        seed=PRECISION_CHECK_SEED,
+    )
+
+    start = time.perf_counter()
+    audio, _ = main.generate_cond_batch(
+        prompts=[prompt],
+        seconds_total=seconds_total,
+        steps=steps,
+        seed=PRECISION_CHECK_SEED,
+    )
+    return audio.cpu(), time.perf_counter() - start
+
+
+def get_precision_log_path(model_name):
+    from .main import get_local_dir
+
+    return os.path.join(get_local_dir(model_name), "precision_check.json")
+
+
+def run_precision_check(model_name, precision, prompt, steps, seconds_total):
+    from . import main
+
+    if model_name is None:
+        raise Exception("Select a model to run the precision check")
+    if precision == "fp32":
+        raise Exception("Select a reduced precision mode to compare against fp32")
+
+    steps = int(steps)
+
+    # Holds the lock for both reloads and generations, so UI requests wait
+    # instead of running on a model that is being swapped out
+    with main.model_lock:
+        previous_options = main.load_options
+        options = {
+            key: value
+            for key, value in (previous_options or {}).items()
+            if key not in ["model_name", "precision"]
+        }
+        # Reduced precision modes need fp32 weights, the reference uses them too
+        options["model_half"] = False
+        try:
+            main.load_model_by_name(model_name, precision="fp32", **options)
+            reference, reference_seconds = timed_generation(
+                prompt, steps, seconds_total
+            )
+
+            main.load_model_by_name(model_name, precision=precision, **options)
+            test, test_seconds = timed_generation(prompt, steps, seconds_total)
+
+            from stable_audio_tools.interface.gradio import model
+
+            device = get_execution_device(model)
+        finally:
+            if previous_options is not None:
+                main.load_model_by_name(**previous_options)
+
+    report = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "precision": precision,
+        "device": str(device),
+        "threads": torch.get_num_threads(),
+        "prompt": prompt,
+        "steps": steps,
+        "seconds_total": seconds_total,
+        "fp32_seconds": round(reference_seconds, 3),
+        "test_seconds": round(test_seconds, 3),
+        "speedup": round(reference_seconds / test_seconds, 3),
+        "snr_db": round(snr_db(reference, test), 2),
+        "spectral_distance": round(spectral_distance(reference, test), 4),
+    }
+    print(report)
+
+    log_path = get_precision_log_path(model_name)
+    log = []
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            log = json.load(f)
+    log.append(report)
+    with open(log_path, "w") as f:
+        json.dump(log, f, indent=2)
+
+    return report
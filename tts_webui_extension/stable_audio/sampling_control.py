@@ -0,0 +1,166 @@
+# Step profiles, early exit and cancellation for the k-diffusion samplers
+import time
+import threading
+import itertools
+from collections import Counter
+
+SAMPLER_TYPES = [
+    "dpmpp-2m-sde",
+    "dpmpp-3m-sde",
+    "k-heun",
+    "k-lms",
+    "k-dpmpp-2s-ancestral",
+    "k-dpm-2",
+    "k-dpm-fast",
+]
+
+# Reduced step counts per sampler. Second order samplers (heun, dpm-2,
+# dpmpp-2s-ancestral) evaluate the model twice per step, so they get about
+# half the steps of the multistep ones for a similar latency.
+GENERATION_PROFILES = {
+    "Fast": {
+        "dpmpp-2m-sde": 32,
+        "dpmpp-3m-sde": 32,
+        "k-heun": 16,
+        "k-lms": 40,
+        "k-dpmpp-2s-ancestral": 16,
+        "k-dpm-2": 16,
+        "k-dpm-fast": 24,
+    },
+    "Balanced": {
+        "dpmpp-2m-sde": 64,
+        "dpmpp-3m-sde": 64,
+        "k-heun": 32,
+        "k-lms": 80,
+        "k-dpmpp-2s-ancestral": 32,
+        "k-dpm-2": 32,
+        "k-dpm-fast": 48,
+    },
+}
+
+PROFILE_CHOICES = ["Custom", *GENERATION_PROFILES.keys()]
+
+# Early exit never triggers before this fraction of the scheduled steps
+EARLY_EXIT_MIN_FRACTION = 0.25
+
+
+def resolve_steps(profile, sampler_type, steps):
+    if profile in GENERATION_PROFILES:
+        return GENERATION_PROFILES[profile].get(sampler_type, int(steps))
+    return int(steps)
+
+
+def get_dpm_fast_orders(nfe):
+    # Mirrors DPMSolver.dpm_solver_fast, which calls back once per solver
+    # iteration of one to three model evaluations
+    m = nfe // 3 + 1
+    if nfe % 3 == 0:
+        return [3] * (m - 2) + [2, 1]
+    return [3] * (m - 1) + [nfe % 3]
+
+
+def get_step_counts(sampler_type, steps):
+    # Steps spent by each callback index, in units of the steps argument
+    if sampler_type == "k-dpm-fast":
+        return list(itertools.accumulate(get_dpm_fast_orders(steps)))
+    return list(range(1, steps + 1))
+
+
+class StopSampling(Exception):
+    def __init__(self, reason, denoised):
+        super().__init__(reason)
+        self.reason = reason
+        self.denoised = denoised
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason, steps_used=0):
+        super().__init__(f"Generation stopped: {reason}")
+        self.reason = reason
+        self.steps_used = steps_used
+
+
+# Outcome counts of the generations run by this process, with the sampler
+# steps spent on each outcome
+metrics = Counter()
+metrics_lock = threading.Lock()
+
+
+def count(outcome, steps=0):
+    with metrics_lock:
+        metrics[outcome] += 1
+        metrics[f"{outcome}_steps"] += steps
+
+
+def get_metrics():
+    with metrics_lock:
+        return dict(metrics)
+
+
+class SamplingMonitor:
+    def __init__(
+        self,
+        steps,
+        early_exit_threshold=0.0,
+        callback=None,
+        is_cancelled=None,
+        deadline=None,
+        sampler_type=None,
+    ):
+        self.steps = steps
+        self.step_counts = get_step_counts(sampler_type, steps)
+        self.early_exit_threshold = early_exit_threshold or 0.0
+        self.callback = callback
+        self.is_cancelled = is_cancelled
+        # Wall clock time (time.time()) so it carries over to worker processes
+        self.deadline = deadline
+        self.steps_used = 0
+        self.stop_reason = None
+        self.previous = None
+
+    def check_cancelled(self):
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise GenerationCancelled("cancelled")
+        if self.deadline is not None and time.time() > self.deadline:
+            raise GenerationCancelled("deadline_exceeded")
+
+    def __call__(self, callback_info):
+        denoised = callback_info["denoised"]
+        i = callback_info["i"]
+        self.steps_used = self.step_counts[i] if i < len(self.step_counts) else i + 1
+
+        self.check_cancelled()
+
+        if self.callback is not None:
+            self.callback(callback_info)
+
+        if self.early_exit_threshold > 0:
+            change = self.relative_change(denoised)
+            self.previous = denoised.detach().clone()
+            if (
+                change is not None
+                and change < self.early_exit_threshold
+                and self.steps_used >= self.steps * EARLY_EXIT_MIN_FRACTION
+                and self.steps_used < self.steps
+            ):
+                print(
+                    f"Early exit at step {self.steps_used}/{self.steps}, change={change:.5f}"
+                )
+                raise StopSampling("early_exit", denoised)
+
+    def relative_change(self, denoised):
+        import torch
+
+        if self.previous is None:
+            return None
+        previous = self.previous.float()
+        delta = torch.linalg.vector_norm(denoised.float() - previous)
+        return (delta / torch.linalg.vector_norm(previous).clamp(min=1e-8)).item()
+
+    def get_info(self):
+        return {
+            "steps_scheduled": self.steps,
+            "steps_used": self.steps_used,
+            "early_exit_threshold": self.early_exit_threshold,
+            "stop_reason": self.stop_reason,
+        }
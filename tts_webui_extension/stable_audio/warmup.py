@@ -0,0 +1,130 @@
+# Compilation and warm-up after model load
+#
+# The first generation after a load pays for kernel selection, allocator
+# growth and lazy initialisation in the conditioners and the pretransform.
+# Warm-up moves that cost to load time by running a tiny generation, and
+# optionally compiles the DiT and the decoder first. Compiled artifacts are
+# kept in a compile_cache folder inside the model folder.
+import os
+import time
+
+import torch
+
+COMPILE_MODES = ["none", "torch.compile", "TorchScript decoder"]
+
+WARMUP_STEPS = 2
+
+# Compile caches the user pointed somewhere before startup are left alone,
+# the others follow the loaded model
+CACHE_DIR_VARIABLES = {
+    "TORCHINDUCTOR_CACHE_DIR": "inductor",
+    "TRITON_CACHE_DIR": "triton",
+}
+USER_CACHE_DIRS = [name for name in CACHE_DIR_VARIABLES if name in os.environ]
+
+
+def get_compile_cache_dir(model_name):
+    from .main import get_local_dir
+
+    cache_dir = os.path.join(get_local_dir(model_name), "compile_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_decoder(model):
+    pretransform = model.pretransform
+    if pretransform is None:
+        return None
+    return getattr(getattr(pretransform, "model", None), "decoder", None)
+
+
+def compile_model(model, model_name, compile_mode):
+    if compile_mode == "none":
+        return
+
+    cache_dir = get_compile_cache_dir(model_name)
+
+    if compile_mode == "torch.compile":
+        # Inductor and Triton read these lazily, so setting them before the
+        # first compiled call is enough to reuse kernels across restarts.
+        # They are set on every load, so a later model gets its own folder.
+        for name, folder in CACHE_DIR_VARIABLES.items():
+            if name not in USER_CACHE_DIRS:
+                os.environ[name] = os.path.join(cache_dir, folder)
+
+        transformer = getattr(model.model, "model", None)
+        if hasattr(transformer, "_forward"):
+            # Compiling _forward covers both the batched and sequential CFG paths
+            transformer._forward = torch.compile(transformer._forward)  # type: ignore
+        decoder = get_decoder(model)
+        if decoder is not None:
+            model.pretransform.model.decoder = torch.compile(decoder)
+        print(f"Compiled model with torch.compile, cache in {cache_dir}")
+
+    elif compile_mode == "TorchScript decoder":
+        decoder = get_decoder(model)
+        if decoder is None:
+            print("Model has no autoencoder decoder, skipping TorchScript")
+            return
+        model.pretransform.model.decoder = load_or_trace_decoder(
+            model, model_name, decoder, cache_dir
+        )
+
+
+def load_or_trace_decoder(model, model_name, decoder, cache_dir):
+    from .main import get_ckpt_path
+
+    parameter = next(decoder.parameters())
+    ckpt_mtime = int(os.path.getmtime(get_ckpt_path(model_name)))
+    dtype_name = str(parameter.dtype).split(".")[-1]
+    path = os.path.join(
+        cache_dir,
+        f"decoder_{parameter.device.type}_{dtype_name}_{ckpt_mtime}.pt",
+    )
+
+    if os.path.exists(path):
+        print(f"Loading TorchScript decoder from {path}")
+        return torch.jit.load(path, map_location=parameter.device)
+
+    print(f"Tracing decoder to {path}")
+    latent_length = 64
+    example = torch.randn(
+        1,
+        model.pretransform.encoded_channels,
+        latent_length,
+        device=parameter.device,
+        dtype=parameter.dtype,
+    )
+    with torch.no_grad():
+        traced = torch.jit.trace(decoder, example, check_trace=False)
+    torch.jit.save(traced, path)
+    return traced
+
+
+def timed_dummy_generation():
+    from . import main
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    main.generate_cond_batch(
+        prompts=["warm-up"],
+        seconds_total=1,
+        steps=WARMUP_STEPS,
+        seed=0,
+        sampler_type="dpmpp-2m-sde",
+    )
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def warm_up():
+    cold_seconds = timed_dummy_generation()
+    warm_seconds = timed_dummy_generation()
+    report = {
+        "cold_seconds": round(cold_seconds, 3),
+        "warm_seconds": round(warm_seconds, 3),
+    }
+    print(f"Warm-up: first request {cold_seconds:.2f}s, warm {warm_seconds:.2f}s")
+    return report
@@ -0,0 +1,66 @@
+# Memory-mapped checkpoint loading
+#
+# Tensors are views into a private (copy-on-write) mapping of the checkpoint
+# file, so several processes loading the same model share the page cache
+# instead of each holding its own copy of the weights.
+import os
+import json
+import struct
+
+import torch
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def read_safetensors_header(path):
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+
+def load_safetensors_mmap(path):
+    header, data_offset = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(
+        path, shared=False, nbytes=os.path.getsize(path)
+    )
+    buffer = torch.tensor([], dtype=torch.uint8).set_(storage)  # type: ignore
+
+    state_dict = {}
+    for key, info in header.items():
+        start, end = info["data_offsets"]
+        data = buffer[data_offset + start : data_offset + end]
+        state_dict[key] = data.view(SAFETENSORS_DTYPES[info["dtype"]]).reshape(
+            info["shape"]
+        )
+    return state_dict
+
+
+def load_state_dict_mmap(ckpt_path):
+    if ckpt_path.endswith(".safetensors"):
+        return load_safetensors_mmap(ckpt_path)
+    return torch.load(ckpt_path, map_location="cpu", mmap=True)["state_dict"]
+
+
+def assign_state_dict(model, state_dict):
+    # Same key/shape filtering as stable_audio_tools copy_state_dict, but the
+    # parameters take over the mapped tensors instead of copying them
+    model_state_dict = model.state_dict()
+    matching = {
+        key: value
+        for key, value in state_dict.items()
+        if key in model_state_dict and value.shape == model_state_dict[key].shape
+    }
+    model.load_state_dict(matching, strict=False, assign=True)
@@ -0,0 +1,293 @@
+# Multi-process CPU inference
+#
+# Each worker is pinned to its own slice of the available cores with a
+# matching torch thread count, and maps the checkpoint read-only so its
+# weights (DiT, autoencoder) are only resident once per node. The T5 encoder
+# is not in the checkpoint, every worker loads its own copy, as it does the
+# int8 layers in the "int8 dynamic" mode.
+import os
+import time
+import threading
+import itertools
+import multiprocessing as mp
+import queue
+from concurrent.futures import Future, TimeoutError
+
+# Cancel flags are shared memory slots indexed by job id, so a worker can
+# poll them from the sampler callback without a round trip to the parent
+CANCEL_SLOTS = 1024
+
+# Loading a model in every worker can take a while on slow disks
+READY_TIMEOUT_SECONDS = 600
+
+
+def get_available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores, num_workers):
+    # Contiguous slices keep each worker on neighbouring cores, which on
+    # multi-socket machines usually means a single socket
+    num_workers = max(1, min(num_workers, len(cores)))
+    size, remainder = divmod(len(cores), num_workers)
+    slices = []
+    start = 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < remainder else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def pin_worker(cores, threads=None):
+    import torch
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    threads = threads or len(cores)
+    torch.set_num_threads(threads)
+    print(f"Worker {os.getpid()} pinned to cores {cores} with {threads} threads")
+
+
+def generate_job(job, is_cancelled=None):
+    from einops import rearrange
+
+    from . import main
+
+    audio, generation_info = main.generate_cond_batch(**job, is_cancelled=is_cancelled)
+    audio = rearrange(audio, "b d n -> d (b n)")
+    audio = main.audio_to_int16(audio)
+    return (main.sample_rate, rearrange(audio, "d n -> n d").numpy()), generation_info
+
+
+def worker_main(
+    model_name, cores, threads, precision, cancel_flags, job_queue, result_queue
+):
+    import torch
+
+    from . import main
+    from .sampling_control import GenerationCancelled
+
+    pin_worker(cores, threads)
+    try:
+        main.load_model_by_name(
+            model_name,
+            device=torch.device("cpu"),
+            mmap_weights=True,
+            precision=precision,
+        )
+    except Exception as e:
+        result_queue.put((None, "load_failed", (os.getpid(), repr(e))))
+        return
+    result_queue.put((None, "ready", os.getpid()))
+
+    while True:
+        item = job_queue.get()
+        if item is None:
+            break
+        job_id, job = item
+        slot = job_id % CANCEL_SLOTS
+        result_queue.put((job_id, "started", os.getpid()))
+        try:
+            result = generate_job(job, lambda: cancel_flags[slot] == 1)
+            result_queue.put((job_id, "done", result))
+        except GenerationCancelled as e:
+            result_queue.put((job_id, "cancelled", (e.reason, e.steps_used)))
+        except Exception as e:
+            result_queue.put((job_id, "failed", repr(e)))
+
+
+class WorkerPool:
+    def __init__(
+        self, model_name, num_workers, threads_per_worker=None, precision="fp32"
+    ):
+        # spawn so that no torch thread pools are inherited from the parent
+        ctx = mp.get_context("spawn")
+        self.job_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.cancel_flags = ctx.Array("b", CANCEL_SLOTS, lock=False)
+        self.futures = {}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closing = False
+        # Job each worker pid is running, to fail it if the worker dies
+        self.running = {}
+        self.ready = []
+        self.load_errors = []
+        self.loaded = threading.Condition(self.lock)
+
+        self.core_slices = split_cores(get_available_cores(), num_workers)
+        self.workers = [
+            ctx.Process(
+                target=worker_main,
+                args=(
+                    model_name,
+                    cores,
+                    threads_per_worker,
+                    precision,
+                    self.cancel_flags,
+                    self.job_queue,
+                    self.result_queue,
+                ),
+                daemon=True,
+            )
+            for cores in self.core_slices
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def _collect(self):
+        from .sampling_control import GenerationCancelled, count
+
+        while True:
+            try:
+                job_id, status, payload = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if status == "stop":
+                break
+            if status in ["ready", "load_failed"]:
+                with self.loaded:
+                    if status == "ready":
+                        print(f"Stable Audio worker {payload} ready")
+                        self.ready.append(payload)
+                    else:
+                        print(f"Stable Audio worker {payload[0]} failed to load")
+                        self.load_errors.append(payload[1])
+                    self.loaded.notify_all()
+                continue
+            with self.lock:
+                if status == "started":
+                    self.running[payload] = job_id
+                    continue
+                self.running = {
+                    pid: running_id
+                    for pid, running_id in self.running.items()
+                    if running_id != job_id
+                }
+                future = self.futures.pop(job_id, None)
+            if future is None:
+                # Already failed because its worker was reported dead
+                continue
+            if status == "done":
+                info = payload[1]
+                count(info.get("stop_reason") or "completed", info["steps_used"])
+                future.set_result(payload)
+            elif status == "cancelled":
+                count(*payload)
+                future.set_exception(GenerationCancelled(*payload))
+            else:
+                future.set_exception(Exception(payload))
+
+    def _check_workers(self):
+        with self.lock:
+            if self.closing:
+                return
+            dead = [w for w in self.workers if not w.is_alive()]
+            failed = []
+            for worker in dead:
+                job_id = self.running.pop(worker.pid, None)
+                if job_id is not None and job_id in self.futures:
+                    failed.append(self.futures.pop(job_id))
+            if len(dead) == len(self.workers):
+                # Nothing is left to pick up the queued jobs
+                failed.extend(self.futures.values())
+                self.futures.clear()
+        for future in failed:
+            future.set_exception(Exception("Stable Audio worker exited"))
+
+    def wait_ready(self, timeout=READY_TIMEOUT_SECONDS):
+        # Until every worker reported ready or exited, polling because a
+        # worker that crashes while loading sends nothing
+        deadline = time.time() + timeout
+        with self.loaded:
+            while time.time() < deadline and not all(
+                worker.pid in self.ready or not worker.is_alive()
+                for worker in self.workers
+            ):
+                self.loaded.wait(timeout=1)
+            return list(self.ready), list(self.load_errors)
+
+    def submit(self, **job):
+        if not any(worker.is_alive() for worker in self.workers):
+            raise Exception("No Stable Audio worker is running, restart the pool")
+        future = Future()
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.futures[job_id] = future
+        self.cancel_flags[job_id % CANCEL_SLOTS] = 0
+        future.job_id = job_id  # type: ignore
+        self.job_queue.put((job_id, job))
+        return future
+
+    def cancel(self, job_id):
+        # Queued jobs are dropped as soon as a worker picks them up, running
+        # ones stop at the next sampler step
+        self.cancel_flags[job_id % CANCEL_SLOTS] = 1
+
+    def generate(self, cancel_event=None, **job):
+        future = self.submit(**job)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except TimeoutError:
+                if cancel_event is not None and cancel_event.is_set():
+                    self.cancel(future.job_id)  # type: ignore
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.result_queue.put((None, "stop", None))
+        self.collector.join()
+
+
+pool = None
+
+
+def start_pool(model_name, num_workers, threads_per_worker=None, precision="fp32"):
+    global pool
+
+    if model_name is None:
+        raise Exception("Select a model to start the worker pool")
+
+    stop_pool()
+    pool = WorkerPool(
+        model_name,
+        int(num_workers),
+        int(threads_per_worker or 0) or None,
+        precision,
+    )
+    ready, load_errors = pool.wait_ready()
+    if not ready:
+        for worker in pool.workers:
+            worker.terminate()
+        stop_pool()
+        raise Exception(
+            f"No worker loaded {model_name}: {'; '.join(load_errors) or 'timed out'}"
+        )
+
+    status = f"Started {len(ready)} workers on cores {pool.core_slices}"
+    if len(ready) < len(pool.workers):
+        status += f", {len(pool.workers) - len(ready)} failed to load"
+        if load_errors:
+            status += f": {'; '.join(load_errors)}"
+    return status
+
+
+def stop_pool():
+    global pool
+
+    if pool is not None:
+        pool.close()
+        pool = None
+    return "Worker pool stopped"